@@ -3,28 +3,77 @@
 '''
 from bsptexremap import consts
 from bsptexremap.enums import DumpTexInfoParts
-from bsptexremap.materials import MaterialConfig, MaterialSet, TextureRemapper
+from bsptexremap.materials import MaterialConfig, MaterialSet, RemapPlanner, \
+                                  materials_cache
+from bsptexremap.wadindex import wad_index
 from bsptexremap.utils import *
 from bsptexremap.bsputil import *
 from bsptexremap.common import * # parse_arguments etc
-from jankbsp import BspFileBasic as BspFile
+from bsptexremap.manifest import BuildManifest, file_hash
+from jankbsp import BspFileBasic as BspFile, probe
 from pathlib import Path
-import logging, tomllib
+from concurrent.futures import ProcessPoolExecutor # process_batch
+import multiprocessing # freeze_support
+import logging, tomllib, os, time
 
-def process_bsp(cfg, args):
-    # load bsp
+def manifest_inputs(args, bsppath, matpath):
+    ''' fingerprints of what the result depends on, besides the bsp itself
+        (which also holds the remap entities). None if there's no
+        materials.txt to go by
+    '''
+    if not matpath: return None
+    MaterialConfig.setup(bsp_modname_from_path(matpath))
+    custommat = bsp_custommat_path(bsppath)
+    custommat_arg = getattr(args, consts.CUSTOMMAT_ARG)
+    return {
+        "version": consts.VERSION,
+        "materials": [str(matpath), file_hash(matpath)],
+        "matchars": [MaterialSet.MATCHARS, MaterialSet.DEF_MAT],
+        "custommat": file_hash(custommat) if custommat.exists() else None,
+        "custommat_arg": file_hash(custommat_arg) \
+                if custommat_arg and Path(custommat_arg).exists() else None,
+        "options": [args.custommat_read_all, args.dump_texinfo],
+    }
+
+def process_bsp(cfg, args, bsppath, manifest=None):
     # with_suffix is required to be compatible with other compilers which omits 
     # the file extension
-    bsppath = Path(args.bsppath).with_suffix(".bsp")
+    bsppath = Path(bsppath).with_suffix(".bsp")
+    outpath = Path(args.outpath) if args.outpath else bsppath
+
+    # configure MaterialConfig with the entries from the cfg
+    MaterialConfig.config(cfg["Materials"])
+
+    # skip the map if it's been processed with the same inputs already.
+    # the texinfo dump isn't tracked, so asking for it never skips
+    inputs = None
+    if manifest is not None:
+        entities = probe(bsppath, guess_lumpenum(bsppath)).entities
+        matpath = search_materials_file(bsppath, entities,
+                getattr(args, consts.CMDLINE_MATPATH_KEY)
+        )
+        inputs = manifest_inputs(args, bsppath, matpath)
+        if inputs and not args.force and not args.dump_texinfo \
+        and manifest.is_up_to_date(bsppath, outpath, inputs):
+            print(f'Skipping "{bsppath}": unchanged since it was last processed')
+            return 0
+
+    planner = None # set when renaming
+    def finish():
+        ''' records the map in the manifest as processed '''
+        if inputs is not None and outpath.exists():
+            manifest.record(bsppath, outpath, inputs,
+                            planner.assignments if planner else None)
+        return 0
+
+    # load bsp
     print(f'Loading bsp file: "{bsppath}"')
     with open(bsppath, "r+b") as f:
         bsp = BspFile(f)
         
-    # configure MaterialConfig with the entries from the cfg
-    # then setup it for the current game, which sets MaterialSet.MATCHARS appropriately
+    # setup MaterialConfig for the current game, which sets MaterialSet.MATCHARS appropriately
     # we need to do this before dump_texinfo which now uses MaterialConfig 
     # to get the material names
-    MaterialConfig.config(cfg["Materials"])
     MaterialConfig.setup(bsp_modname_from_path(bsppath))
     
     # texinfo dump zenpen (embedded/external/grouped)
@@ -32,10 +81,11 @@ def process_bsp(cfg, args):
         texinfo_parts = flag_str_parser(DumpTexInfoParts)(args.dump_texinfo)
         dump_texinfo(bsppath, 3072|(texinfo_parts&7), bsp)
     
-    # look for materials path
-    matpath = search_materials_file(bsppath, bsp.entities,
-            getattr(args, consts.CMDLINE_MATPATH_KEY)
-    )
+    # look for materials path, unless done above already
+    if manifest is None:
+        matpath = search_materials_file(bsppath, bsp.entities,
+                getattr(args, consts.CMDLINE_MATPATH_KEY)
+        )
     if not matpath:
         log.critical("No materials.txt to read.")
         return 1 # error
@@ -45,7 +95,7 @@ def process_bsp(cfg, args):
     MaterialConfig.setup(bsp_modname_from_path(matpath))
     
     # load THE materials set
-    material_set = MaterialSet.from_materials_file(matpath)
+    material_set = materials_cache.load(matpath)
     print(f'{len(material_set):>3d} entries read from materials file.')
     infolog_material_set(material_set)
     
@@ -64,7 +114,7 @@ def process_bsp(cfg, args):
             getattr(args, consts.CUSTOMMAT_ARG), not args.custommat_read_all)
     if not len(wannabe_set):
         print("No texture remap entries found. Nothing to do.")
-        return 0
+        return finish()
     print(f'{len(wannabe_set)} texture remap entries.')
     infolog_material_set(wannabe_set)
     
@@ -75,30 +125,145 @@ def process_bsp(cfg, args):
     # go ahead and rename them textures
     # there's a fn for this in bsputil but I want to make it happen in main
     print("Renaming textures now...")
-    remapperfn = TextureRemapper(wannabe_set, choice_set)
+    # don't hand out names of textures the map already has or its wads have,
+    # and give textures the same names as the last time where possible
+    planner = RemapPlanner(reserved=[miptex.name for miptex in bsp.textures]
+                                    + wad_texture_names(bsppath, bsp.entities),
+            assignments=manifest.remaps_of(bsppath) if manifest else None)
+    remaps = planner.remap_all((miptex.name for miptex in bsp.textures_m),
+                               wannabe_set, choice_set)
     succ_count, fail_count = 0,0
     for miptex in bsp.textures_m:
-        newname = remapperfn(miptex.name)
+        newname = remaps[miptex.name]
         if newname and newname.lower() != miptex.name.lower():
-            log.info(f"{miptex.name:15s} --> {newname}")
+            log.info("%-15s --> %s", miptex.name, newname)
             miptex.name = newname
             succ_count += 1
         else:
-            log.info(f"{miptex.name:15s} --> (unchanged)")
+            log.info("%-15s --> (unchanged)", miptex.name)
             fail_count += 1
     print(f"Success count: {succ_count}")
     print(f"Failure count: {fail_count}")
     if not succ_count:
         print("No changed made to texture names. Exiting.")
-        return 0
+        return finish()
     
     # write to file
-    outpath = Path(args.outpath) if args.outpath else bsppath
     print(f"Writing changes to file: {outpath.name}")
-    with open(outpath, "wb") as f:
-        bsp.dump(f)
+    # renames into the same file are patched in place, else dump it in full
+    in_place = outpath.resolve() == bsppath.resolve()
+    with open(outpath, "r+b" if in_place else "wb") as f:
+        if not in_place or bsp.patch(f) is None:
+            f.seek(0)
+            f.truncate()
+            bsp.dump(f)
     
     # END OF MAIN
+    return finish()
+
+
+# batch mode worker state, set by init_worker
+_worker_cfg, _worker_args, _worker_manifest = None, None, None
+
+def init_worker(cfg, args):
+    ''' sets up a batch mode worker process with the shared inputs '''
+    global _worker_cfg, _worker_args, _worker_manifest
+    _worker_cfg, _worker_args = cfg, args
+    _worker_manifest = BuildManifest()
+    materials_cache.path = get_base_path().with_name(consts.MATCACHE_FILENAME)
+    wad_index.path = get_base_path().with_name(consts.WADINDEX_FILENAME)
+    if not logging.getLogger().handlers: # spawned rather than forked
+        setup_logger(args.log)
+
+def process_bsp_task(bsppath):
+    ''' process_bsp for a batch mode worker. returns the result code and
+        the manifest records to hand over to the main process
+    '''
+    try:
+        result = process_bsp(_worker_cfg, _worker_args, bsppath, _worker_manifest)
+    except Exception:
+        log.exception(f"Error processing {bsppath}")
+        result = 1
+    materials_cache.save()
+    wad_index.save()
+    return result, _worker_manifest.take_updates()
+
+def process_batch(cfg, args, bsppaths):
+    ''' process_bsp over many maps with a pool of args.jobs processes,
+        then prints a summary
+    '''
+    jobs = min(args.jobs or os.cpu_count() or 1, len(bsppaths))
+    print(f"Processing {len(bsppaths)} BSP files with {jobs} process(es)")
+    if jobs == 1:
+        init_worker(cfg, args)
+        outcomes = list(map(process_bsp_task, bsppaths))
+    else:
+        with ProcessPoolExecutor(jobs, initializer=init_worker,
+                                 initargs=(cfg, args)) as executor:
+            outcomes = list(executor.map(process_bsp_task, bsppaths))
+
+    manifest = BuildManifest()
+    for _, updates in outcomes:
+        manifest.merge(updates)
+    manifest.save()
+    results = [result for result, _ in outcomes]
+
+    failed = [path for path, result in zip(bsppaths, results) if result]
+    print("----SUMMARY----")
+    print(f"Maps processed: {len(bsppaths) - len(failed)}")
+    print(f"Maps failed:    {len(failed)}")
+    for path in failed:
+        print(f"  failed: {path}")
+    return 1 if failed else 0
+
+
+def scan_bsps(folder) -> dict:
+    ''' {path: (size, mtime)} of the BSP files in folder '''
+    result = {}
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.name.lower().endswith(".bsp"): continue
+            try:
+                stat = entry.stat()
+            except OSError: # deleted in the meantime
+                continue
+            result[Path(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+    return result
+
+def watch(cfg, args, folder):
+    ''' processes BSP files in folder as they get written, until interrupted.
+        a file is processed once it stops changing between two looks
+    '''
+    folder = Path(folder)
+    print(f'Watching "{folder}" for compiled BSP files. Press Ctrl+C to stop.')
+    manifest = BuildManifest()
+    seen = scan_bsps(folder) # as of the last time processed (or startup)
+    changing = {} # stamps of changed files as of the last look
+    try:
+        while True:
+            time.sleep(consts.WATCH_POLL_INTERVAL)
+            current = scan_bsps(folder)
+            for path in list(seen):
+                if path not in current: del seen[path]
+            for path, stamp in current.items():
+                if seen.get(path) == stamp:
+                    changing.pop(path, None)
+                elif changing.get(path) != stamp:
+                    changing[path] = stamp # still being written, look again
+                else:
+                    del changing[path]
+                    print(f"----{path.name}----")
+                    try:
+                        process_bsp(cfg, args, path, manifest)
+                    except Exception:
+                        log.exception(f"Error processing {path}")
+                    manifest.save()
+                    materials_cache.save()
+                    wad_index.save()
+                    # don't pick up our own write as a change
+                    seen[path] = scan_bsps(folder).get(path, stamp)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
     return 0
 
 
@@ -113,11 +278,36 @@ def main():
     # set log level
     setup_logger(args.log)
     log = logging.getLogger() ## "__main__" should use the root logger
+    materials_cache.path = get_base_path().with_name(consts.MATCACHE_FILENAME)
+    wad_index.path = get_base_path().with_name(consts.WADINDEX_FILENAME)
+    if args.watch:
+        if args.outpath:
+            log.critical("-out can't be used with -watch.")
+            return 1
+        return watch(cfg, args, args.watch)
+
+    bsppaths = expand_bsppaths(args.bsppath)
+    if not bsppaths:
+        log.critical("No BSP files to process.")
+        return 1
+    if args.outpath and len(bsppaths) > 1:
+        log.critical("-out can only be used with a single BSP file.")
+        return 1
+
     print("----START----")
-    result = process_bsp(cfg,args)
+    if len(bsppaths) == 1:
+        manifest = BuildManifest()
+        result = process_bsp(cfg, args, bsppaths[0], manifest)
+        manifest.save()
+        materials_cache.save()
+        wad_index.save()
+    else:
+        result = process_batch(cfg, args, bsppaths)
     print("-----END-----")
     return result
     
 if __name__=="__main__":
+    # batch mode workers re-launch the frozen exe, which has to run them
+    multiprocessing.freeze_support()
     result = main()
     exit(result)
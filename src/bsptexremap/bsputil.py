@@ -5,6 +5,7 @@
 from . import consts, materials
 from jankbsp import BspFile
 from jankbsp.enums import Lumps, BlueShiftLumps
+from jankbsp.types import EntityList
 from pathlib import Path
 import re
 
@@ -36,6 +37,8 @@ def guess_lumpenum(bsppath:Path):
 ##-----------------------------------
 
 def iter_texremap_entities(bsp_entities) -> list:
+    if isinstance(bsp_entities, EntityList): # use the classname index
+        return bsp_entities.query_select(consts.TEXREMAP_ENTITY_CLASSNAME)
     fn = lambda ent: ent["classname"] == consts.TEXREMAP_ENTITY_CLASSNAME
     return filter(fn, bsp_entities)
 
@@ -8,8 +8,9 @@ from .enums import DumpTexInfoParts # , MaterialEnum # dump_texinfo
 from .materials import MaterialConfig, MaterialSet, TextureRemapper
 
 # get_textures_from_wad
-from jankbsp import WadFile
-from jankbsp.types.wad import WadMipTex
+from .wadindex import wad_index
+from .resolver import TextureResolver # search_wads
+from jankbsp.pakfile import find_in_paks # search_materials_file
 
 from argparse import ArgumentParser
 from pathlib import Path, PurePath
@@ -40,6 +41,10 @@ def parse_arguments(gui=False):
             "-backup", action="store_true",
             help="makes backup of BSP file",
         )
+        parser.add_argument(
+            "-force", action="store_true",
+            help="process BSP files even if nothing changed since they were last processed",
+        )
 
     ## arguments that take value -----------------------------------------------
     loglevels = ["off"]+[l.lower() for l in logging.getLevelNamesMapping().keys()]
@@ -74,6 +79,14 @@ def parse_arguments(gui=False):
             "-out", metavar="OUTPATH", dest="outpath",
             help="outputs the edited BSP file here instead of overwriting",
         )
+        parser.add_argument(
+            "-watch", metavar="MAPS_DIR",
+            help="keep running, and process BSP files in this folder as soon as they're (re)compiled",
+        )
+        parser.add_argument(
+            "-jobs", metavar="N", type=int, default=0,
+            help="number of processes to work on multiple BSP files with (default: one per CPU)",
+        )
 
     # bsp path
     if gui:
@@ -84,13 +97,34 @@ def parse_arguments(gui=False):
         parser.add_argument("-dev",action="store_true",help="dev mode")
     else:
         # required for CLI
-        parser.add_argument("bsppath",
-                help="BSP file to operate on",
+        parser.add_argument("bsppath", nargs="*",
+                help="BSP file(s) to operate on. folders and glob patterns are expanded to the BSP files in them",
         )
 
     return parser.parse_args()
 
 
+def expand_bsppaths(items) -> list[Path]:
+    ''' expands the bsppath arguments to a list of BSP paths:
+        folders to the .bsp files in them, glob patterns to their matches,
+        and anything else to itself with the .bsp extension
+    '''
+    result = []
+    for item in items:
+        path = Path(item)
+        if path.is_dir():
+            result += sorted(p for p in path.iterdir() if p.suffix.lower() == ".bsp")
+        elif any(c in item for c in "*?["):
+            anchor = Path(path.anchor) if path.is_absolute() else Path()
+            pattern = str(path.relative_to(anchor)) if path.is_absolute() else item
+            result += sorted(p for p in anchor.glob(pattern) if p.is_file())
+        else:
+            # with_suffix is required to be compatible with other compilers
+            # which omits the file extension
+            result.append(path.with_suffix(".bsp"))
+    return list(dict.fromkeys(result)) # removes duplicates, keeping order
+
+
 def setup_logger(level:str|int):
     level = logging.getLevelName(level.upper())
 
@@ -202,31 +236,46 @@ def search_materials_file(bsp_path, bsp_entities=[], args_matpath=None):
             candidate = modpath / "sound/materials.txt"
             if candidate.exists():
                 return candidate
+            candidate = find_in_paks(modpath, "sound/materials.txt")
+            if candidate:
+                log.info(f"Found materials.txt in {candidate.pak.name}")
+                return candidate
 
     log.warn("No materials.txt file found.")
 
 
-def search_wads(bsp_path, wadlist):
+def wad_texture_names(bsp_path, bsp_entities) -> list[str]:
+    ''' names of the textures in the wads the map uses, found through the
+        mod's TextureResolver. names to keep remapped textures from shadowing
+    '''
+    bsp_path = Path(bsp_path)
+    wads = bsputil.list_wads(bsp_entities)
+    if not wads or bsp_path.parent.name.lower() != "maps": return []
+    resolver = TextureResolver.for_modpath(bsp_path.parents[1])
+    try:
+        return [loc.name for loc in resolver.texture_map(wads).values()]
+    except (OSError, ValueError) as e:
+        log.warning(f"couldn't read the wads of the map: {e}")
+        return []
+
+
+def search_wads(bsp_path, wadlist, refresh=False):
     ''' returns a dict of the search result:
         key being wad name and value being path if found, or None
-        wadlist items will be popped once found, using its length to track progress
+        looks through the mod's folders with its TextureResolver, which lists
+        each folder once. refresh to pick up files added since
     '''
     bsp_path = Path(bsp_path)
     result = {wad:None for wad in wadlist} # initialize to all None (not found)
-    counter = 0
 
     if bsp_path.parent.name.lower() == "maps":
         log.info("Trying to find wad files relative to map...")
-        for modpath in modpath_fallbacks(bsp_path.parents[1]):
-            if counter == len(wadlist): break # already found everything
-            log.info(f"looking in {modpath}")
-            for wad in wadlist:
-                if result[wad]: continue # already found this one
-                candidate = modpath / wad
-                if candidate.exists():
-                    log.info(f"found {wad} in {modpath}!")
-                    result[wad] = candidate
-                    counter += 1
+        resolver = TextureResolver.for_modpath(bsp_path.parents[1])
+        if refresh: resolver.refresh()
+        for wad in wadlist:
+            result[wad] = resolver.find_wad(wad)
+            if result[wad]:
+                log.info(f"found {wad} in {result[wad].parent}!")
     return result
 
 
@@ -369,18 +418,11 @@ def get_textures_from_wad(wadpath:str|Path, texture_names:str) -> tuple[dict,lis
         the latter would be used to check that unembedding textures don't leave
         orphans
     '''
-    texture_names = [x.lower() for x in texture_names]
-    result = {}
-
-    with open(wadpath, "rb") as fp:
-        wad = WadFile.load(fp, True)
-        for item in wad.entries:
-            if item.name.lower() not in texture_names: continue
-            # log.debug(f"{item.name} is wanted and found")
-            fp.seek(item.offset)
-            result[item.name] = WadMipTex.load(fp,item.sizeondisk)
-
-    return (result, tuple((item.name for item in wad.entries)))
+    with wad_index.open(wadpath) as wad:
+        result = wad.read_miptexes(texture_names)
+        names = tuple(item.name for item in wad.entries)
+
+    return (result, names)
 
 
 def backup_file(filepath:Path|str):
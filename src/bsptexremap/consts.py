@@ -31,6 +31,15 @@ CUSTOMMAT_SUFFIX            = "_custommat"
 CUSTOMMAT_FMT               = ".txt"
 CUSTOMMAT_ARG               = "custommat_path"
 
+# .wadindex, saved next to the program
+WADINDEX_FILENAME           = "BspTexRemap.wadindex.json"
+# .matcache, parsed materials.txt files, saved next to the program
+MATCACHE_FILENAME           = "BspTexRemap.matcache.pickle"
+# .manifest, saved in the mod folder
+MANIFEST_FILENAME           = "BspTexRemap.manifest.json"
+# -watch, seconds between each look at the folder
+WATCH_POLL_INTERVAL         = 1.0
+
 # .utils.modpath_fallbacks
 MODNAME_SUFFIX_RE           = r"(?i)_(?:downloads|addon)$"
 LIBLIST_FALLBACK_RE         = r"(?im)^fallback_dir\s+(?P<dir>.*)"
@@ -54,7 +63,7 @@ TEX_IGNORE_RE = r"(?i)^(sky|{blue|{invisible|black|aaatrigger|scroll.*)"
 ENT_PROPS_RE  = r"(?i)^(classname|materials_path|spawnflags|angles|origin)$"
 
 MATCHARS = "CMDVGTSWPYFN" # use MaterialSet.MATCHARS instead of this
-# char_padder, MaterialSet.iter_padded_names
+# char_padder, nth_padding, MaterialSet.iter_padded_names
 CHARSEQUENCE = r"~}|{`_^]\[@?>=<;:/.-,+*)(&%$#!ZYXWVUTSRQPONMLKJIHGFEDCBA9876543210"
 
 
@@ -2,7 +2,7 @@
 '''
 import dearpygui.dearpygui as dpg
 
-from jankbsp import BspFileBasic, WadFile
+from jankbsp import BspFileBasic, WadFile, PakPath
 from jankbsp.types import EntityList
 from jankbsp.types.wad import WadMipTex
 
@@ -11,7 +11,7 @@ from ..enums import MaterialEnum, DumpTexInfoParts
 from ..common import * # This inserts consts, so must come before .consts!!!
 from ..utils import failure_returns_none
 from ..bsputil import list_wads, guess_lumpenum, bsp_custommat_path, iter_texremap_entities
-from ..materials import MaterialConfig, MaterialSet, TextureRemapper
+from ..materials import MaterialConfig, MaterialSet, RemapPlanner, materials_cache
 
 from . import consts, mappings, gui_utils
 from .mappings import BindingType, RemapEntityActions
@@ -21,6 +21,8 @@ from .galleryview import GalleryView
 from .dbgtools import *
 from .colors import MaterialColors
 from .pickleddict import PickledDict
+from ..wadindex import wad_index
+from ..resolver import TextureResolver
 
 from pathlib import Path
 from dataclasses import dataclass, field #, asdict
@@ -45,6 +47,7 @@ class AppModel:
     mat_set      : MaterialSet = field(default_factory=MaterialSet)
     wannabe_set  : MaterialSet = field(default_factory=MaterialSet)
     direct_remap : dict        = field(default_factory=dict)
+    remap_planner : RemapPlanner = None # set on load_bsp
 
     # settings
     auto_load_materials : bool = True # try find materials.path
@@ -83,6 +86,10 @@ class AppModel:
         self.bsppath = Path(bsppath)
         with open(self.bsppath, "rb") as f:
             self.bsp = BspFile(f, lump_enum=guess_lumpenum(self.bsppath))
+        # keeps the names handed out across edits of this bsp
+        self.remap_planner = RemapPlanner(
+                reserved=[item.name for item in self.bsp.textures]
+                         + wad_texture_names(self.bsppath, self.bsp.entities))
 
         ## reset all the matchars
         #MaterialConfig.setup(bsp_modname_from_path(self.bsppath))
@@ -137,8 +144,9 @@ class AppModel:
             self.wannabe_set |= MaterialSet.from_entity(texremap_ent)
 
     def load_materials(self, matpath):
-        self.matpath = Path(matpath)
-        self.mat_set = MaterialSet.from_materials_file(self.matpath)
+        self.matpath = matpath if isinstance(matpath, PakPath) else Path(matpath)
+        self.mat_set = materials_cache.load(self.matpath)
+        materials_cache.save()
         self.app.view.reflect()
         self.app.view.render_material_tables()
 
@@ -203,11 +211,12 @@ class AppModel:
                            if item.become_external==True]
 
         ## 2. texture renamings
-        tr = TextureRemapper(target_set = self.wannabe_set,
-                             choice_set = self.mat_set.choice_cut(),
-                             map_dict = self.direct_remap)
-
-        remap_dict = {item.name:tr(item.name) for item in self.bsp.textures}
+        # only textures whose remap changed since the last time get new names
+        remap_dict = self.remap_planner.remap_all(
+                (item.name for item in self.bsp.textures),
+                target_set = self.wannabe_set,
+                choice_set = self.mat_set.choice_cut(),
+                map_dict = self.direct_remap)
         remap_dict = {oldname:newname for oldname,newname in remap_dict.items() \
                       if newname != oldname}
 
@@ -391,6 +400,8 @@ class AppView:
 
     def __post_init__(self):
         self.wad_cache = PickledDict(_cache_path=self.app.cfg["basepath"].parent/"temp")
+        wad_index.path = self.app.cfg["basepath"].with_name(consts.WADINDEX_FILENAME)
+        materials_cache.path = self.app.cfg["basepath"].with_name(consts.MATCACHE_FILENAME)
 
 
     def bind(self, tag, type:BindingType, prop=None, data=None,
@@ -592,51 +603,45 @@ class AppView:
         log.info(f"{len(wanted_list)} external textures wanted")
         if not len(wanted_list): return
 
-        wadpaths = entries.values()
-
-        log.info(f"loading all wad files simultaneously-ish...")
-        _resultparts = namedtuple("ResultParts", ["miptexes","names"])
-        taskfn = failure_returns_none(get_textures_from_wad)
-        results = {}
-        log.debug("START")
+        # the paths are the ones the mod's resolver found (see update_wadlist),
+        # so it looks up every texture at once, the first wad winning
+        resolver = TextureResolver.for_modpath(self.app.data.bsppath.parents[1])
+        wads = [entries[order] for order in sorted(entries)]
+        log.info(f"loading textures from {len(wads)} wad files...")
         with time_it():
-            with ThreadPoolExecutor() as executor:
-                for wadpath, result \
-                in zip(wadpaths, executor.map(taskfn, wadpaths,
-                                              [wanted_list]*len(wadpaths))):
-
-                    # result is a tuple of loaded miptex list and name list
-                    results[wadpath] = _resultparts(*result)
-
-        for order, wadpath in entries.items():
-            wadname = Path(wadpath).name
-            status = {"loaded": False if results[wadpath] is None else True}
-
-            if results[wadpath].miptexes is None:
+            locations = resolver.resolve(wanted_list, wads)
+            loaded = resolver.load_miptexes(wanted_list, wads)
+        wad_index.save()
+
+        by_wad = {} # [wadpath] = {waddirentry name: miptex}
+        for name, miptex in loaded.items():
+            location = locations[name]
+            # fix the miptex name to the waddirentry's.
+            # I'm not sure if the engine only considers the waddirentry's name
+            # but it makes sense
+            miptex.name = location.name
+            by_wad.setdefault(location.wadpath, {})[location.name] = miptex
+
+        for order in sorted(entries):
+            wadpath = entries[order]
+            wadname = wadpath.name
+            status = {"loaded": wadpath not in resolver.failed}
+
+            if wadpath in resolver.failed:
                 log.warning(f"failed to load textures from {wadname}")
 
-            elif len(results[wadpath].miptexes):
-                # something is loaded (empty means can load but found nothing)
-                log.debug(f"updating textures with {wadname} ({len(results[wadpath])} items)")
-
-                # fix the miptex name to the waddirentry's.
-                # I'm not sure if the engine only considers the waddirentry's name
-                # but it makes sense
-                # NOTE: result is a dict. translate to list
-                miptexes = []
-                for direntryname, miptex in results[wadpath].miptexes.items():
-                    miptex.name = direntryname
-                    miptexes.append(miptex)
-
-                status["loaded_count"] = self.load_textures(miptexes, True, wadname, order)
+            elif wadpath in by_wad:
+                # something is loaded (absent means can load but found nothing)
+                miptexes = by_wad[wadpath]
+                log.debug(f"updating textures with {wadname} ({len(miptexes)} items)")
+                status["loaded_count"] = self.load_textures(
+                        list(miptexes.values()), True, wadname, order)
+                # cache the miptexes
+                self.wad_cache[wadname] = miptexes
 
             else:
                 status["loaded_count"] = 0
 
-            # cache the miptexes
-            if results[wadpath].miptexes:
-                self.wad_cache[wadname] = results[wadpath].miptexes
-
             log.debug(f"updating wadstats for {wadname}")
             item = next(filter(lambda x:x.name==wadname,self.wadstats),None)
             if item: item.update(**status)
@@ -649,7 +654,7 @@ class AppView:
         list(x.delete() for x in self.wadstats) # make sure the bound dpg item is deleted
         self.wadstats = [WadStatus(w,i) for i,w in enumerate(wads)]
 
-        wad_found_paths = search_wads(self.app.data.bsppath, wads)
+        wad_found_paths = search_wads(self.app.data.bsppath, wads, True)
         for item in self.wadstats:
             item.update(found=bool(wad_found_paths[item.name]))
             item.path = wad_found_paths[item.name]
@@ -1000,8 +1005,12 @@ class AppActions:
             backup_file(self.app.data.bsppath)
 
         result = self.app.data.commit_bsp_edits()
-        with open(self.app.data.bsppath, "wb") as f:
-            result.bsp.dump(f)
+        with open(self.app.data.bsppath, "r+b") as f:
+            # patch renames in place if that's all there is, else dump in full
+            if result.bsp.patch(f) is None:
+                f.seek(0)
+                f.truncate()
+                result.bsp.dump(f)
 
         log.info('Saved BSP file: "%s"', self.app.data.bsppath)
 
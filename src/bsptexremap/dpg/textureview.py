@@ -4,17 +4,13 @@ from ..materials import MaterialSet
 from .ntuple import ntuple
 from .colors import MaterialColors, AppColors, AppThemes, get_material_theme
 from dataclasses import dataclass, field # TextureView
-from itertools import chain
 from typing import ClassVar
 from logging import getLogger
 import re
 log = getLogger(__name__)
 
-def flatten_imgdata(imgdata):
-    return list(chain(*imgdata))
-
 def img_to_dpg(img):
-    return [n/256.0 for n in flatten_imgdata(img.convert("RGBA").getdata())]
+    return [n/256.0 for n in img.convert("RGBA").tobytes()]
 
 @dataclass
 class TextureView:
@@ -0,0 +1,132 @@
+''' manifest.py
+    incremental build manifest: remembers what each map was last processed
+    with, so that maps whose inputs haven't changed since can be skipped.
+
+    one manifest file per mod folder, keyed by bsp path. a record holds the
+    fingerprints of the inputs (tool version, materials.txt, custommat files,
+    options) and the stamp (size, mtime) and hash of the bsp written, which
+    is compared first by stamp, and only hashed when the stamp differs.
+    the remap entities live in the bsp, so they're covered by its hash.
+    the names each texture got are kept too, so that a recompiled map gets
+    the same ones (see RemapPlanner).
+'''
+from . import consts
+from jankbsp import PakPath
+from pathlib import Path
+from hashlib import blake2b
+import json, os, logging
+log = logging.getLogger(__name__)
+
+def file_hash(path) -> str:
+    if isinstance(path, PakPath):
+        return blake2b(path.read_bytes()).hexdigest()
+    digest = blake2b()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_stamp(path) -> list:
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+def file_info(path) -> dict:
+    return {"stamp": file_stamp(path), "hash": file_hash(path)}
+
+def matches(path, info) -> bool:
+    ''' whether the file at path is still the one described by info '''
+    try:
+        if file_stamp(path) == info["stamp"]: return True
+        return file_hash(path) == info["hash"] # touched, but same content
+    except OSError:
+        return False
+
+
+class BuildManifest:
+    ''' the manifests of every mod folder touched, loaded on demand.
+        new records are kept in updates until save(), so that batch workers
+        can hand theirs over to the main process (take_updates/merge)
+    '''
+    def __init__(self):
+        self._files = {} # [manifest path] = {bsp path: record}
+        self.updates = {} # same, only records added since loading
+
+    @staticmethod
+    def manifest_path(bsppath:Path) -> Path:
+        ''' the mod folder's manifest, or next to the bsp if not in maps/ '''
+        folder = bsppath.parents[1] if bsppath.parent.name.lower() == "maps" \
+                 else bsppath.parent
+        return folder / consts.MANIFEST_FILENAME
+
+    @staticmethod
+    def _read(path:Path) -> dict:
+        try:
+            data = json.loads(path.read_bytes())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning(f"couldn't read build manifest {path}: {e}")
+            return {}
+        return data.get("maps", {}) if data.get("version") == 1 else {}
+
+    def _manifest(self, bsppath:Path) -> tuple[str, dict]:
+        key = str(self.manifest_path(bsppath))
+        if key not in self._files:
+            self._files[key] = self._read(Path(key))
+        return key, self._files[key]
+
+    def is_up_to_date(self, bsppath:Path, outpath:Path, inputs:dict) -> bool:
+        ''' whether bsppath was processed into outpath with the same inputs,
+            and neither has changed since
+        '''
+        _, records = self._manifest(bsppath)
+        record = records.get(str(bsppath.resolve()))
+        if record is None or record["inputs"] != inputs: return False
+        if record["output"]["path"] != str(outpath.resolve()): return False
+        if not matches(outpath, record["output"]): return False
+        # written elsewhere, so the source must be unchanged too
+        return "source" not in record or matches(bsppath, record["source"])
+
+    def remaps_of(self, bsppath:Path) -> dict:
+        ''' the RemapPlanner assignments bsppath was last processed with '''
+        _, records = self._manifest(bsppath)
+        return records.get(str(bsppath.resolve()), {}).get("remaps", {})
+
+    def record(self, bsppath:Path, outpath:Path, inputs:dict, remaps:dict=None):
+        ''' records that bsppath has been processed into outpath, with the
+            RemapPlanner assignments if given (else the previous ones are kept)
+        '''
+        record = {
+            "inputs": inputs,
+            "output": {"path": str(outpath.resolve()), **file_info(outpath)},
+            "remaps": self.remaps_of(bsppath) if remaps is None else remaps,
+        }
+        if outpath.resolve() != bsppath.resolve():
+            record["source"] = file_info(bsppath)
+        key, records = self._manifest(bsppath)
+        records[str(bsppath.resolve())] = record
+        self.updates.setdefault(key, {})[str(bsppath.resolve())] = record
+
+    def take_updates(self) -> dict:
+        updates, self.updates = self.updates, {}
+        return updates
+
+    def merge(self, updates:dict):
+        for key, records in updates.items():
+            self._files.setdefault(key, {}).update(records)
+            self.updates.setdefault(key, {}).update(records)
+
+    def save(self):
+        ''' writes out the manifests that got new records, merged over what's
+            on disk now
+        '''
+        for key, records in self.take_updates().items():
+            path = Path(key)
+            data = self._read(path)
+            data.update(records)
+            tmppath = path.with_suffix(".tmp")
+            try:
+                tmppath.write_text(json.dumps({"version": 1, "maps": data}, indent=1))
+                os.replace(tmppath, path)
+            except OSError as e:
+                log.warning(f"couldn't save build manifest {path}: {e}")
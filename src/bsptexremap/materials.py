@@ -1,54 +1,108 @@
 ''' materials.py
     classes that deal with materials go here
 '''
-from . import consts, common
-from .utils import char_padder
+from . import consts # common is imported in MaterialConfig.setup (circular)
+from .utils import char_padder, nth_padding, padding_index
 from .enums import MaterialEnum
+from jankbsp.pakfile import PakPath # from_materials_file
 #from .common import modpath_fallbacks
-import re
+import re, os, pickle
 from pathlib import Path
 from typing import ClassVar
 from collections import namedtuple
-from logging import getLogger
+from itertools import accumulate # NameAllocator
+from logging import getLogger, DEBUG
 log = getLogger(__name__)
 
+TEX_PARTS = re.compile(consts.TEX_PARTS_RE)
+TEX_IGNORE = re.compile(consts.TEX_IGNORE_RE)
+# materials.txt entry: material char, prefixes (which shouldn't be there),
+# then the name. comments and the rest of the line are left out
+MATLINE_RE = re.compile(r"^[ \t]*([^\s/]+)[ \t]+([!@{]?(?:-\d|\+[0-9a-z])?~?)([^\s/]*)",
+                        re.M | re.I)
+
 
 class TextureRemapper:
     ''' creates a callable instance, that returns a remapped texname as specified
         in the initial target and choice MaterialSets,
         target_set being the texnames that wanted to be the specified material,
         choice_Set being the set with the valid entries from materials.txt,
-        map_dict being direct map, no questions asked
+        map_dict being direct map, no questions asked,
+        reserved being the names already taken (see NameAllocator)
 
         sample usage:
-        >>> tm = TextureRemapper(wannabe_set, choice_set)
+        >>> tm = TextureRemapper(wannabe_set, choice_set, reserved=oldnames)
+        >>> newnames = tm.remap_all(oldnames) # {oldname: newname}
+        or
         >>> for miptex in bsp.miptexes:
         >>>     miptex.name = tm(miptex.name)
-        or
-        >>> newnames = list(map(tm, oldnames))
     '''
-    def __init__(self, target_set, choice_set, map_dict={}):
+    def __init__(self, target_set, choice_set, map_dict={}, reserved=()):
         self.target_set = target_set
         self.choice_set = choice_set
         self.map_dict = {k.upper():v for k,v in map_dict.items()}
         self.groupmap = {} # tracks group names, so it returns the same remapped names
-        self.iterators = dict({m:{} for m in MaterialSet.MATCHARS})
-
-    def get_iterator(self, mat:str, targetlen:int):
-        ''' returns the appropriate iter_padded_names for specified mat and len
-            (creating the iterators on the fly as needed)
-        '''
-        log.debug("mat: %s, targetlen: %d", mat, targetlen)
-        self.iterators.setdefault(mat, {})
-        return self.iterators[mat].setdefault(
-            targetlen,
-            self.choice_set.iter_padded_names(mat,targetlen)
-        )
+        self.allocator = NameAllocator(choice_set, map(MaterialSet.strip, reserved))
+        # direct remap targets aren't handed out either
+        self.exclude = frozenset(name.upper() for name in self.map_dict.values())
 
     def __call__(self, texname:str) -> str:
         ''' the call method of the instance
         '''
-        parts = re.match(consts.TEX_PARTS_RE, texname)
+        return self._remap(texname, TEX_PARTS.match(texname), {})
+
+    def remap_all(self, names) -> dict:
+        ''' {name: remapped name} of the names, same as calling the instance
+            on each of them in order, but the target set is looked up once per
+            texgroup (so +0/+A/-0 frames share it)
+        '''
+        lookups = {} # [texgroupname] = target material
+        parsed = {texname: TEX_PARTS.match(texname) for texname in names}
+        for (mat, targetlen), count in self._shortages(parsed, lookups).items():
+            log.warning("%d textures can't be remapped to %s: out of names %d characters long",
+                        count, mat, targetlen)
+        return {texname: self._remap(texname, parts, lookups)
+                for texname, parts in parsed.items()}
+
+    def shortages(self, names) -> dict:
+        ''' {(mat, targetlen): count} of the names that remap_all would run
+            out of material names for
+        '''
+        return self._shortages({texname: TEX_PARTS.match(texname)
+                                for texname in names}, {})
+
+    def _target(self, texname:str, parts, lookups:dict) -> str|None:
+        ''' the material texname is to be remapped to, if it can be '''
+        # IMPORTANT: material set consistently populated with uppercase values
+        texgroupname = parts["texname"].upper()
+        if texgroupname not in lookups:
+            lookups[texgroupname] = self.target_set.get_mattype_of(texgroupname)
+        targetmat = lookups[texgroupname]
+
+        if targetmat is None \
+        or TEX_IGNORE.match(texname) \
+        or len(parts["prefix"]) > 2:
+            return None
+        return targetmat
+
+    def _shortages(self, parsed:dict, lookups:dict) -> dict:
+        demand = {} # [(mat, targetlen)] = names needed
+        groups = set(self.groupmap)
+        for texname, parts in parsed.items():
+            texgroupname = parts["texname"].upper()
+            if texgroupname in self.map_dict or texgroupname in groups: continue
+            if (targetmat := self._target(texname, parts, lookups)) is None: continue
+            if parts["grouped"]: groups.add(texgroupname)
+            key = (targetmat, consts.TEXNAME_MAX_LEN - len(parts["prefix"]))
+            demand[key] = demand.get(key, 0) + 1
+        result = {}
+        for (mat, targetlen), count in demand.items():
+            available = self.allocator.available(mat, targetlen, self.exclude)
+            if count > available:
+                result[(mat, targetlen)] = count - available
+        return result
+
+    def _remap(self, texname:str, parts, lookups:dict) -> str:
         # IMPORTANT: material set consistently populated with uppercase values
         texgroupname = parts["texname"].upper()
 
@@ -56,34 +110,218 @@ class TextureRemapper:
             log.debug("%s found in dict", texgroupname)
             return parts["prefix"] + self.map_dict[texgroupname]
 
-        elif texgroupname not in self.target_set \
-        or re.match(consts.TEX_IGNORE_RE, texname) \
-        or len(parts["prefix"]) > 2:
-            log.debug("%15s (%15s) fails check: %s|%s|%s",
-                      texgroupname, texname,
-                      texgroupname not in self.target_set,
-                      re.match(consts.TEX_IGNORE_RE, texname),
-                      len(parts["prefix"]) > 2 )
+        if (targetmat := self._target(texname, parts, lookups)) is None:
+            if log.isEnabledFor(DEBUG):
+                log.debug("%15s (%15s) fails check: %s|%s|%s",
+                          texgroupname, texname,
+                          lookups[texgroupname] is None,
+                          TEX_IGNORE.match(texname),
+                          len(parts["prefix"]) > 2 )
             return texname
 
         elif texgroupname in self.groupmap:
             log.debug("%s in group", texgroupname)
             return parts["prefix"] + self.groupmap[texgroupname]
 
-        targetmat = self.target_set.get_mattype_of(texgroupname)
         targetlen = consts.TEXNAME_MAX_LEN - len(parts["prefix"])
-        result = next(self.get_iterator(targetmat,targetlen), None)
+        result = self.allocator.allocate(targetmat, targetlen, self.exclude)
         if not result: # exhausted available names for this mattype+len combo
-            log.debug(f"{texgroupname} ran out of material names")
+            log.debug("%s ran out of material names", texgroupname)
             return texname # unchanged
 
         if parts["grouped"]:
             self.groupmap[texgroupname] = result
 
-        log.debug(f"%15s -> %s", texgroupname, result)
+        log.debug("%15s -> %s", texgroupname, result)
         return parts["prefix"] + result
 
 
+class NameAllocator:
+    ''' hands out padded material names, in the order of iter_padded_names,
+        never the same one twice, nor any of the reserved names.
+        the pool of each material and target length is only a cursor over the
+        choice set's names and their paddings, so allocating stays O(1) and
+        what's left in it is known without generating anything
+    '''
+    def __init__(self, choice_set, reserved=()):
+        self.choice_set = choice_set
+        self.reserved = set() # uppercase, and handed out. add with reserve()
+        self.sources = {} # [name handed out] = choice set name it's made of
+        self._pools = {} # [(mat, targetlen)] = _Pool
+        self._by_len = {} # [length] = ([reserved names], [pools])
+        for name in reserved: self.reserve(name)
+
+    class _Pool:
+        def __init__(self, names, targetlen):
+            # a name that extends an earlier one by padding chars only would
+            # just yield names of the earlier one's paddings again, so skip it
+            kept = set()
+            for name in names:
+                if not any(name[:k] in kept and padding_index(name[k:]) is not None
+                           for k in range(1, len(name))):
+                    kept.add(name)
+            self.names = [name for name in names if name in kept]
+            self.padlens = [targetlen - len(name) for name in self.names]
+            self.sizes = [len(consts.CHARSEQUENCE) ** n for n in self.padlens]
+            # [i] = how many names from the i-th name's paddings on
+            self.tails = list(accumulate(reversed(self.sizes), initial=0))[::-1]
+            self.cur, self.pos = 0, 0 # name index, padding index
+            self.index = {name: i for i, name in enumerate(self.names)}
+            self.lengths = sorted(set(map(len, self.names)))
+            # [uppercase name] = (name, source) passed over for being excluded
+            self.deferred = {}
+            self.reserved_ahead = 0 # reserved names the cursor hasn't passed
+
+        def ahead(self, name:str) -> bool:
+            ''' whether name is one of the candidates the cursor hasn't
+                passed yet. each candidate comes from a single name
+            '''
+            for length in self.lengths:
+                i = self.index.get(name[:length])
+                if i is None or i < self.cur: continue
+                k = padding_index(name[length:])
+                if k is not None and (i > self.cur or k >= self.pos):
+                    return True
+            return False
+
+    def _pool(self, mat:str, targetlen:int):
+        key = (mat, targetlen)
+        if key not in self._pools:
+            log.debug("mat: %s, targetlen: %d", mat, targetlen)
+            names = [name for name in self.choice_set.sorted_names(mat)
+                     if len(name) <= targetlen]
+            pool = self._Pool(names, targetlen)
+            reserved, pools = self._by_len.setdefault(targetlen, ([], []))
+            pool.reserved_ahead = sum(map(pool.ahead, reserved))
+            pools.append(pool)
+            self._pools[key] = pool
+        return self._pools[key]
+
+    def reserve(self, name:str, source:str=None):
+        ''' takes the name out of every pool, as made of source if given '''
+        key = name.upper()
+        if key in self.reserved: return
+        self.reserved.add(key)
+        if source is not None: self.sources[name] = source
+        reserved, pools = self._by_len.setdefault(len(key), ([], []))
+        reserved.append(key)
+        for pool in pools:
+            if pool.deferred.pop(key, None) is None and pool.ahead(key):
+                pool.reserved_ahead += 1
+
+    def available(self, mat:str, targetlen:int, exclude=frozenset()) -> int:
+        ''' how many names are left to hand out, leaving out the reserved ones
+            and those in exclude (uppercase)
+        '''
+        pool = self._pool(mat, targetlen)
+        excluded = sum(1 for name in exclude if len(name) == targetlen
+                       and name not in self.reserved
+                       and (name in pool.deferred or pool.ahead(name)))
+        return pool.tails[pool.cur] - pool.pos - pool.reserved_ahead \
+               + len(pool.deferred) - excluded
+
+    def allocate(self, mat:str, targetlen:int, exclude=frozenset()) -> str|None:
+        ''' the next free name of the material and length, None if exhausted.
+            names in exclude (uppercase) are skipped for this time only
+        '''
+        pool = self._pool(mat, targetlen)
+        for key, (name, source) in pool.deferred.items():
+            if key not in exclude:
+                del pool.deferred[key]
+                return self._hand_out(name, source)
+        while pool.cur < len(pool.names):
+            i = pool.cur
+            name = pool.names[i] + nth_padding(pool.pos, pool.padlens[i])
+            pool.pos += 1
+            if pool.pos == pool.sizes[i]:
+                pool.cur, pool.pos = i + 1, 0
+            key = name.upper()
+            if key in self.reserved:
+                pool.reserved_ahead -= 1 # passed it
+                continue
+            if key in exclude:
+                pool.deferred[key] = (name, pool.names[i])
+                continue
+            return self._hand_out(name, pool.names[i])
+        return None
+
+    def _hand_out(self, name:str, source:str) -> str:
+        self.reserve(name, source)
+        return name
+
+
+class RemapPlanner:
+    ''' TextureRemapper.remap_all that remembers what each texture got, so
+        that when the target set, direct remaps or choice set change, only the
+        textures affected get new names, and the others keep theirs.
+        assignments can be saved and given back to a new planner to get the
+        same names across runs
+
+        sample usage:
+        >>> planner = RemapPlanner(reserved=oldnames)
+        >>> newnames = planner.remap_all(oldnames, wannabe_set, choice_set)
+        >>> wannabe_set["M"].add("CRATE")
+        >>> newnames = planner.remap_all(oldnames, wannabe_set, choice_set)
+    '''
+    def __init__(self, reserved=(), assignments=None):
+        # names the map already has, kept apart from the names handed out
+        self.existing = frozenset(MaterialSet.strip(name).upper()
+                                  for name in reserved)
+        # [texname] = [mat, new texgroup name, choice set name it's made of]
+        self.assignments = dict(assignments or {})
+        self._allocator = None
+        self._choice_stamp = None
+
+    def _valid(self, assignment, targetmat, targetlen, choice_set, exclude) -> bool:
+        mat, name, source = assignment
+        return mat == targetmat and len(name) == targetlen \
+               and source in choice_set[mat] and name.startswith(source) \
+               and name.upper() not in self.existing \
+               and name.upper() not in exclude
+
+    def remap_all(self, names, target_set, choice_set, map_dict={}) -> dict:
+        ''' {name: remapped name} of the names, keeping the previous names of
+            the textures still remapped to the same material
+        '''
+        # names handed out so far stay taken while the choice set is the same
+        stamp = (id(choice_set), choice_set._version)
+        if stamp != self._choice_stamp:
+            self._allocator = NameAllocator(choice_set, self.existing)
+            self._choice_stamp = stamp
+        tr = TextureRemapper(target_set, choice_set, map_dict)
+        tr.allocator = self._allocator # direct remaps are only tr.exclude'd
+
+        result, lookups = {}, {}
+        kept = {} # [name] = texgroupname it's kept for
+        parsed = {texname: TEX_PARTS.match(texname) for texname in names}
+        for texname, parts in parsed.items():
+            texgroupname = parts["texname"].upper()
+            assignment = self.assignments.get(texname)
+            if assignment is None or texgroupname in tr.map_dict: continue
+            targetmat = tr._target(texname, parts, lookups)
+            targetlen = consts.TEXNAME_MAX_LEN - len(parts["prefix"])
+            name = assignment[1]
+            if not self._valid(assignment, targetmat, targetlen,
+                               choice_set, tr.exclude) \
+            or kept.setdefault(name.upper(), texgroupname) != texgroupname:
+                continue
+            tr.allocator.reserve(name, assignment[2]) # if a new allocator
+            if parts["grouped"]:
+                tr.groupmap.setdefault(texgroupname, name)
+            result[texname] = parts["prefix"] + name
+
+        log.debug("%d of %d textures keep their names", len(result), len(parsed))
+        rest = [texname for texname in parsed if texname not in result]
+        for texname, newname in tr.remap_all(rest).items():
+            result[texname] = newname
+            parts = parsed[texname]
+            name = newname[len(parts["prefix"]):]
+            if name in tr.allocator.sources and newname != texname:
+                self.assignments[texname] = [tr._target(texname, parts, lookups),
+                                             name, tr.allocator.sources[name]]
+        return {texname: result[texname] for texname in parsed}
+
+
 class MaterialConfig:
     ''' class-var to hold material configuration from the cfg.toml file
         setup() interacts with MaterialSet, setting its MATCHARS
@@ -179,6 +417,72 @@ class MaterialConfig:
         return [x["game"] for x in cls._config if "game" in x]
 
 
+class MaterialNames(set):
+    ''' the names of one material in a MaterialSet. changes made through it,
+        including directly (matset["C"].add(name)), are reported to the owner
+        so it can keep its reverse index and cached views in sync
+    '''
+    def __init__(self, iterable=(), owner=None, mat=None):
+        super().__init__(iterable)
+        self.owner, self.mat = owner, mat
+
+    def _added(self, names):
+        if self.owner is not None: self.owner._added(self.mat, names)
+
+    def _removed(self, names):
+        if self.owner is not None: self.owner._removed(self.mat, names)
+
+    def add(self, name):
+        if name in self: return
+        super().add(name)
+        self._added((name,))
+
+    def update(self, *others):
+        names = set().union(*others)
+        super().update(names)
+        self._added(names)
+
+    def discard(self, name):
+        if name not in self: return
+        super().discard(name)
+        self._removed((name,))
+
+    def remove(self, name):
+        super().remove(name) # raises KeyError
+        self._removed((name,))
+
+    def pop(self):
+        name = super().pop()
+        self._removed((name,))
+        return name
+
+    def clear(self):
+        names = set(self)
+        super().clear()
+        self._removed(names)
+
+    def difference_update(self, *others):
+        names = self.intersection(set().union(*others))
+        super().difference_update(names)
+        self._removed(names)
+
+    def intersection_update(self, *others):
+        names = self.difference(set(self).intersection(*others))
+        super().difference_update(names)
+        self._removed(names)
+
+    def symmetric_difference_update(self, other):
+        other = set(other)
+        common, new = self & other, other - self
+        self.difference_update(common)
+        self.update(new)
+
+    def __ior__(self, other): self.update(other); return self
+    def __isub__(self, other): self.difference_update(other); return self
+    def __iand__(self, other): self.intersection_update(other); return self
+    def __ixor__(self, other): self.symmetric_difference_update(other); return self
+
+
 class MaterialSet(dict):
     ''' class for parsing, processing, and outputting goldsrc material lists.
 
@@ -197,39 +501,99 @@ class MaterialSet(dict):
         ''' helper fn that strips prefixes from texture names, forming a proper
             material name
         '''
-        m = re.match(consts.TEX_PARTS_RE, instr)
+        m = TEX_PARTS.match(instr)
         return m["texname"] if m else instr
 
 
     def __init__(self, **kwargs):
+        self._version = 0 # bumped on every change, stamps the cached views
+        self._views = {}
+        self._reverse = None # {name: mat}, built on first lookup
         for mat in self.__class__.MATCHARS:
-            super().update({mat: set(kwargs[mat]) if mat in kwargs else set()})
+            super().__setitem__(mat, MaterialNames(kwargs.get(mat, ()), self, mat))
+
+    def __setitem__(self, mat, names):
+        super().__setitem__(mat, MaterialNames(names, self, mat))
+        self._version += 1
+        self._reverse = None
+
+    def __reduce__(self):
+        return (self.__class__, (), None, None,
+                ((m, set(names)) for m, names in self.items()))
+
+    def _added(self, mat, names):
+        ''' MaterialNames hook. a name in several sets belongs to the first '''
+        self._version += 1
+        if self._reverse is None: return
+        order = {m: i for i, m in enumerate(self)}
+        for name in names:
+            cur = self._reverse.get(name)
+            if cur is None or order[mat] < order[cur]:
+                self._reverse[name] = mat
+
+    def _removed(self, mat, names):
+        ''' MaterialNames hook '''
+        self._version += 1
+        if self._reverse is None: return
+        for name in names:
+            if self._reverse.get(name) != mat: continue
+            del self._reverse[name]
+            for m, s in self.items(): # falls back to another set having it
+                if name in s:
+                    self._reverse[name] = m
+                    break
+
+    def _reverse_index(self) -> dict:
+        if self._reverse is None:
+            self._reverse = {}
+            for mat, names in reversed(self.items()): # first set wins
+                self._reverse.update(dict.fromkeys(names, mat))
+        return self._reverse
+
+    def _cached(self, key, build):
+        ''' view of the set built with build(), until the set changes '''
+        cached = self._views.get(key)
+        if cached is None or cached[0] != self._version:
+            cached = self._views[key] = (self._version, build())
+        return cached[1]
 
 
     @classmethod
     def from_materials_file(cls, file):
-        self = cls()
+        ''' parses the file. see also materials_cache.load '''
         log.info(f"Reading materials file: {file}")
-        report_incompat = 0
-        with open(file, "r") as f:
-            for line in f.readlines():
-                parts = line.split("//", 1)[0].split(" ",2)
-                if len(parts) < 2: continue
+        return cls._from_record(cls._read_materials_file(file))
 
-                matchar, matname = parts[0].strip(), cls.strip(parts[1])
-                if not len(matchar) or matchar not in cls.MATCHARS:
-                    log.warning("read unknown material type %s", matchar)
-                    continue
-                # matname not matching read entry indicates prefixes in entries
-                if len(matname) != len(parts[1].strip()):
-                    report_incompat += 1
+    @classmethod
+    def _read_materials_file(cls, file) -> dict:
+        ''' the entries of the file, as plain data to be cached '''
+        # materials.txt may also come from inside a pak
+        text = file.read_text(errors="replace") if isinstance(file, PakPath) \
+               else Path(file).read_text(errors="replace")
+        names = {mat: [] for mat in cls.MATCHARS}
+        unknown, report_incompat = {}, 0
+        for matchar, prefix, matname in MATLINE_RE.findall(text):
+            if matchar not in names:
+                unknown[matchar] = unknown.get(matchar, 0) + 1
+                continue
+            # prefixes in entries
+            if prefix: report_incompat += 1
+            if matname: names[matchar].append(matname.upper())
+        return {
+            "names": {m: tuple(v) for m, v in names.items()},
+            "unknown": unknown,
+            "incompat": report_incompat,
+        }
 
-                self[matchar.upper()].add(matname.upper())
+    @classmethod
+    def _from_record(cls, record):
+        ''' the MaterialSet of _read_materials_file, with its warnings '''
+        for matchar, count in record["unknown"].items():
+            log.warning("read unknown material type %s (%d entries)", matchar, count)
+        if record["incompat"]:
+            log.warning("%d entries found with prefixes. This may mean that the mod doesn't support the texture name hack, and the texture remappings may not work.",record["incompat"])
 
-        if report_incompat:
-            log.warning("%d entries found with prefixes. This may mean that the mod doesn't support the texture name hack, and the texture remappings may not work.",report_incompat)
-
-        return self
+        return cls(**record["names"])
 
     @classmethod
     def from_entity(cls, ent):
@@ -246,10 +610,20 @@ class MaterialSet(dict):
 
     def get_mattype_of(self, texgroupname:str) -> str:
         ''' returns the name of the material set containing texgroupname '''
-        texgroupname = MaterialSet.strip(texgroupname)
-        for m in MaterialSet.MATCHARS:
-            if texgroupname in self[m]:
-                return m
+        return self._reverse_index().get(MaterialSet.strip(texgroupname))
+
+    def sorted_names(self, mat:str) -> tuple:
+        ''' names of the material, sorted '''
+        return self._cached(("sorted", mat), lambda: tuple(sorted(self[mat])))
+
+    def name_pools(self, mat:str) -> dict:
+        ''' {length: sorted names of that length} of the material '''
+        def build():
+            pools = {}
+            for name in self.sorted_names(mat):
+                pools.setdefault(len(name), []).append(name)
+            return {k: tuple(v) for k, v in sorted(pools.items())}
+        return self._cached(("pools", mat), build)
 
     def iter_padded_names(self, mat:str, targetlen:int) -> str:
         ''' generator that yields a name from the target material padded with
@@ -261,7 +635,8 @@ class MaterialSet(dict):
                 g = MaterialSet.iter_padded_names(mat, len)
                 newname = next(g,None)
         '''
-        for texgroupname in sorted(self[mat]):
+        for texgroupname in self.sorted_names(mat):
+            if len(texgroupname) > targetlen: continue # doesn't fit
             for padstr in char_padder(targetlen - len(texgroupname)):
                 yield texgroupname + padstr
 
@@ -271,7 +646,7 @@ class MaterialSet(dict):
 
     def __contains__(self, texgroupname:str):
         ''' check if texgroupname is in any of the material sets '''
-        return True if self.get_mattype_of(texgroupname) else False
+        return MaterialSet.strip(texgroupname) in self._reverse_index()
 
     def __len__(self):
         ''' reports the combined number of entries across all material sets '''
@@ -300,7 +675,18 @@ class MaterialSet(dict):
     def choice_cut(self):
         ''' returns a subset with suitable names (length between 12 and 14)
             special case for "C": add "__CONCRETE" to it
+            the cut is kept until either set changes, so don't modify it in place
         '''
+        key = ("choice_cut", self.__class__.MATCHARS, self.__class__.DEF_MAT)
+        cached = self._views.get(key)
+        if cached is not None and cached[0] == self._version \
+        and cached[1]._version == cached[2]:
+            return cached[1]
+        cut = self._choice_cut()
+        self._views[key] = (self._version, cut, cut._version)
+        return cut
+
+    def _choice_cut(self):
         concrete_admix = {"__CONCRETE"}
         cutfn = lambda tex: consts.MATNAME_MIN_LEN <= len(tex) <= consts.TEXNAME_MAX_LEN-1
         mapfn = lambda mat,vals: concrete_admix | vals \
@@ -343,3 +729,68 @@ class MaterialSet(dict):
         ''' alias to choice_cut '''
         return self.choice_cut()
 
+
+class MaterialsFileCache:
+    ''' {materials file: MaterialSet} cache. files are parsed once per process,
+        and with a path set, the entries are pickled for the next runs.
+        entries are kept per file and MATCHARS, for as long as the file's size
+        and mtime stay the same.
+        the sets are shared, so don't modify them in place
+    '''
+    VERSION = 1
+
+    def __init__(self, path:Path|str=None):
+        self.path = path
+        self._records = None # loaded on first use
+        self._sets = {} # [key] = (stamp, MaterialSet)
+        self._dirty = False
+
+    def _load(self):
+        self._records = {}
+        if not self.path or not Path(self.path).exists(): return
+        try:
+            data = pickle.loads(Path(self.path).read_bytes())
+        except (OSError, EOFError, pickle.PickleError, ValueError) as e:
+            log.warning(f"couldn't read materials cache: {e}")
+            return
+        if data.get("version") == self.VERSION:
+            self._records = data["files"]
+
+    def load(self, file) -> MaterialSet:
+        ''' MaterialSet.from_materials_file, from the cache if possible '''
+        file = file if isinstance(file, PakPath) else Path(file)
+        stat = file.stat()
+        key = (str(file.resolve()), MaterialSet.MATCHARS)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        if (cached := self._sets.get(key)) is not None and cached[0] == stamp:
+            return cached[1]
+
+        if self._records is None: self._load()
+        record = self._records.get(key)
+        if record is not None and record["stamp"] == stamp:
+            log.info(f"Reading materials file: {file} (cached)")
+        else:
+            log.info(f"Reading materials file: {file}")
+            record = {"stamp": stamp, **MaterialSet._read_materials_file(file)}
+            self._records[key] = record
+            self._dirty = True
+        result = MaterialSet._from_record(record)
+        self._sets[key] = (stamp, result)
+        return result
+
+    def save(self):
+        ''' writes the cache out, if there's a path and anything new '''
+        if not self.path or not self._dirty: return
+        data = pickle.dumps({"version": self.VERSION, "files": self._records})
+        self._dirty = False
+        # batch workers may save at the same time
+        tmppath = Path(self.path).with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmppath.write_bytes(data)
+            os.replace(tmppath, self.path)
+        except OSError as e:
+            log.warning(f"couldn't save materials cache: {e}")
+
+
+# shared by everything that reads materials files in this process
+materials_cache = MaterialsFileCache()
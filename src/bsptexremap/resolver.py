@@ -0,0 +1,198 @@
+''' resolver.py
+    finds external textures across the wads of a game install, the way the
+    engine would: wads in worldspawn order, each looked up through the mod's
+    folders and its fallbacks.
+'''
+from . import consts
+from .wadindex import wad_index
+from jankbsp.pakfile import PakFile, PakPath, BadPakFile, iter_paks
+from pathlib import Path, PureWindowsPath
+from typing import NamedTuple
+from threading import Lock
+import os, re, logging
+log = logging.getLogger(__name__)
+
+class TextureLocation(NamedTuple):
+    wadpath: Path
+    offset: int
+    size: int # on disk
+    name: str # as written in the wad
+
+
+class TextureResolver:
+    ''' built once per mod folder (see for_modpath) and reused for every bsp
+        of it. folder listings and wad directories are read once, then
+        lookups are case-insensitive dict hits. they are read again once
+        the folder or the wad has changed on disk (by mtime, and size for
+        wads), so a long-running process sees new and edited wads.
+    '''
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __init__(self, modpath:Path):
+        self.modpath = Path(modpath)
+        self.search_dirs = list(self.iter_search_dirs(self.modpath))
+        self._listings = {} # [dir] = (stamp, paks, {lowercase filename: path})
+        self._wad_maps = {} # [wadpath] = (stamp, {lowercase texture name: location})
+        self._texture_maps = {} # [wad names] = (wad stamps, merged _wad_maps)
+        self.failed = set() # wadpaths that couldn't be read
+        self._lock = Lock()
+
+    @classmethod
+    def for_modpath(cls, modpath:Path) -> "TextureResolver":
+        ''' the shared resolver of the mod folder '''
+        key = str(Path(modpath).resolve())
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(modpath)
+            return cls._instances[key]
+
+    def refresh(self):
+        ''' forgets the folder listings and wad directories read so far '''
+        with self._lock:
+            self.search_dirs = list(self.iter_search_dirs(self.modpath))
+            self._listings.clear()
+            self._wad_maps.clear()
+            self._texture_maps.clear()
+            self.failed.clear()
+
+    @staticmethod
+    def iter_search_dirs(modpath:Path):
+        ''' existing folders to search, in order of precedence: every folder
+            of modpath_fallbacks, each preceded by its _addon and followed by
+            its _downloads variant
+        '''
+        from .common import modpath_fallbacks # circular import
+        seen = set()
+        for path in modpath_fallbacks(modpath):
+            base = path.with_name(re.sub(consts.MODNAME_SUFFIX_RE, "", path.name))
+            for candidate in (base.with_name(base.name + "_addon"), base,
+                              base.with_name(base.name + "_downloads")):
+                key = str(candidate).lower()
+                if key in seen or not candidate.is_dir(): continue
+                seen.add(key)
+                yield candidate
+
+    @staticmethod
+    def _stamp(path) -> tuple|None:
+        ''' see WadIndexCache.stamp. None if the file is gone '''
+        try:
+            return wad_index.stamp(path)
+        except OSError:
+            return None
+
+    @staticmethod
+    def _folder_stamp(folder:Path, paks) -> tuple:
+        ''' the folder's mtime changes as files come and go, but not when
+            one is rewritten in place, so its paks are stamped as well
+        '''
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            mtime = None
+        return (mtime, *(TextureResolver._stamp(pak) for pak in paks))
+
+    def _listing(self, folder:Path) -> dict:
+        with self._lock:
+            cached = self._listings.get(folder)
+            if cached is not None:
+                stamp, paks, listing = cached
+                if self._folder_stamp(folder, paks) == stamp:
+                    return listing
+            try:
+                listing = {entry.name.lower(): Path(entry.path)
+                           for entry in os.scandir(folder)}
+            except OSError:
+                listing = {}
+            # wads packed at the root of the folder's paks come after
+            paks = iter_paks(folder)
+            stamp = self._folder_stamp(folder, paks)
+            for pakpath in paks:
+                try:
+                    with PakFile(pakpath) as pak:
+                        names = pak.namelist()
+                except (OSError, BadPakFile, ValueError):
+                    continue
+                for name in names:
+                    if "/" in name or "\\" in name: continue
+                    listing.setdefault(name.lower(), PakPath(pakpath, name))
+            self._listings[folder] = (stamp, paks, listing)
+            return listing
+
+    def find_wad(self, wad:str) -> Path|None:
+        ''' path of the wad, given its name or a worldspawn wad path.
+            a PakPath if it's inside a pak
+        '''
+        name = PureWindowsPath(wad).name.lower()
+        for folder in self.search_dirs:
+            if (path := self._listing(folder).get(name)) is not None:
+                return path
+        return None
+
+    def _wad_map(self, wadpath:Path) -> dict:
+        stamp = wad_index.stamp(wadpath)
+        with self._lock:
+            cached = self._wad_maps.get(wadpath)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        result = {}
+        for entry in wad_index.entries(wadpath):
+            result.setdefault(entry.name.lower(), TextureLocation(
+                    wadpath, entry.offset, entry.sizeondisk, entry.name))
+        with self._lock:
+            self._wad_maps[wadpath] = (stamp, result)
+            self.failed.discard(wadpath)
+        return result
+
+    def texture_map(self, wads) -> dict:
+        ''' {lowercase texture name: location} over the wads, the first wad
+            in the list winning like in the engine
+        '''
+        key = tuple(PureWindowsPath(wad).name.lower() for wad in wads)
+        wadpaths = [self.find_wad(wad) for wad in wads]
+        stamps = tuple((wadpath, wadpath and self._stamp(wadpath))
+                       for wadpath in wadpaths)
+        cached = self._texture_maps.get(key)
+        if cached is not None and cached[0] == stamps:
+            return cached[1]
+        result = {}
+        for wad, wadpath in zip(wads, wadpaths):
+            if wadpath is None:
+                log.info(f"{PureWindowsPath(wad).name} not found")
+                continue
+            try:
+                wad_map = self._wad_map(wadpath)
+            except Exception as e: # anything a broken wad may throw
+                log.warning(f"couldn't read {wadpath.name}: {e}")
+                self.failed.add(wadpath)
+                continue
+            for name, location in wad_map.items():
+                result.setdefault(name, location)
+        self._texture_maps[key] = (stamps, result)
+        return result
+
+    def resolve(self, names, wads) -> dict:
+        ''' {name: location} of the names found in the wads '''
+        texture_map = self.texture_map(wads)
+        return {name: texture_map[name.lower()] for name in names
+                if name.lower() in texture_map}
+
+    def load_miptexes(self, names, wads) -> dict:
+        ''' {name: miptex} of the names found in the wads, with one batched
+            read per wad
+        '''
+        by_wad = {}
+        for name, location in self.resolve(names, wads).items():
+            by_wad.setdefault(location.wadpath, []).append(name)
+        result = {}
+        for wadpath, wad_names in by_wad.items():
+            try:
+                with wad_index.open(wadpath) as wad:
+                    found = {k.lower(): v for k, v
+                             in wad.read_miptexes(wad_names).items()}
+            except Exception as e: # anything a broken wad may throw
+                log.warning(f"couldn't read textures from {wadpath.name}: {e}")
+                self.failed.add(wadpath)
+                continue
+            result.update((name, found[name.lower()]) for name in wad_names)
+        return result
@@ -35,6 +35,29 @@ def char_padder(len:int) -> str:
         yield "".join(result)
 
 
+def nth_padding(index:int, length:int) -> str:
+    ''' the padding at index of char_padder(length), without going through
+        the ones before it
+    '''
+    chars = []
+    for _ in range(length):
+        index, digit = divmod(index, len(consts.CHARSEQUENCE))
+        chars.append(consts.CHARSEQUENCE[digit])
+    return "".join(reversed(chars))
+
+
+def padding_index(padding:str) -> int|None:
+    ''' the index of padding in char_padder(len(padding)), or None if it
+        isn't made of CHARSEQUENCE chars
+    '''
+    index = 0
+    for char in padding:
+        digit = consts.CHARSEQUENCE.find(char)
+        if digit < 0: return None
+        index = index * len(consts.CHARSEQUENCE) + digit
+    return index
+
+
 def infolog_material_set(material_set):
     if log.getEffectiveLevel() > logging.INFO: return
     
@@ -0,0 +1,127 @@
+''' wadindex.py
+    persistent cache of wad directories. wads listed in worldspawn are mostly
+    the same ones for every map of an install, so their directories (and the
+    checksums of their entries) are read once, then reused as long as the
+    wad's size and mtime stay the same.
+
+    to use it:
+    >>> from .wadindex import wad_index
+    >>> wad_index.path = some_path # to persist it across runs
+    >>> with wad_index.open(wadpath) as wad: ...
+    >>> wad_index.save()
+'''
+from jankbsp import WadFile, PakPath
+from jankbsp.types.wad import WadDirEntry
+from dataclasses import astuple
+from pathlib import Path
+from threading import Lock
+import json, os, logging
+log = logging.getLogger(__name__)
+
+class WadIndexCache:
+    ''' {wad path: directory} cache, saved as a single json file.
+        without a path, it only lasts for the current process
+    '''
+    VERSION = 1
+
+    def __init__(self, path:Path|str=None):
+        self.path = path
+        self._wads = None # loaded on first use
+        self._dirty = False
+        self._lock = Lock()
+
+    @staticmethod
+    def stamp(wadpath) -> tuple[int, int]:
+        ''' (size, mtime) of the wad (of its pak, if in one). whatever is read
+            off the wad stays valid as long as this stays the same
+        '''
+        stat = wadpath.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _key(wadpath) -> tuple[str, list]:
+        wadpath = wadpath.resolve() if isinstance(wadpath, PakPath) \
+                  else Path(wadpath).resolve()
+        return str(wadpath), list(WadIndexCache.stamp(wadpath))
+
+    def _load(self):
+        self._wads = {}
+        if not self.path or not Path(self.path).exists(): return
+        try:
+            data = json.loads(Path(self.path).read_bytes())
+        except (OSError, ValueError) as e:
+            log.warning(f"couldn't read wad index cache: {e}")
+            return
+        if data.get("version") == self.VERSION:
+            self._wads = data["wads"]
+
+    def _record(self, wadpath) -> dict|None:
+        ''' the cached record of the wad, if still valid '''
+        key, stamp = self._key(wadpath)
+        with self._lock:
+            if self._wads is None: self._load()
+            record = self._wads.get(key)
+        if record is not None and record["stamp"] == stamp:
+            return record
+        return None
+
+    def open(self, wadpath) -> WadFile:
+        ''' opens the wad with WadFile.open_mmap, reading its directory off the
+            cache if possible, or indexing it into the cache otherwise
+        '''
+        if isinstance(wadpath, PakPath): # wad inside a pak
+            opener = lambda entries=None: \
+                     WadFile.from_buffer(wadpath.read_bytes(), entries)
+        else:
+            wadpath = Path(wadpath)
+            opener = lambda entries=None: WadFile.open_mmap(wadpath, entries)
+
+        record = self._record(wadpath)
+        if record is not None:
+            entries = [WadDirEntry(*item[:-1]) for item in record["entries"]]
+            return opener(entries)
+
+        log.debug(f"indexing {wadpath.name}")
+        wad = opener()
+        checksums = wad.checksums()
+        key, stamp = self._key(wadpath)
+        record = {
+            "stamp": stamp,
+            "entries": [[*astuple(entry), checksums[entry.name]]
+                        for entry in wad.entries],
+        }
+        with self._lock:
+            self._wads[key] = record
+            self._dirty = True
+        return wad
+
+    def entries(self, wadpath) -> list[WadDirEntry]:
+        ''' the directory entries of the wad '''
+        with self.open(wadpath) as wad:
+            return wad.entries
+
+    def checksums(self, wadpath) -> dict:
+        ''' {entry name: crc32 of its data} of the wad '''
+        record = self._record(wadpath)
+        if record is None:
+            self.open(wadpath).close()
+            record = self._record(wadpath)
+        return {item[-2]: item[-1] for item in record["entries"]}
+
+    def save(self):
+        ''' writes the cache out, if there's a path and anything new '''
+        if not self.path or not self._dirty: return
+        with self._lock:
+            data = json.dumps({"version": self.VERSION, "wads": self._wads})
+            self._dirty = False
+        # batch workers may save at the same time
+        tmppath = Path(self.path).with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmppath.write_text(data)
+            os.replace(tmppath, self.path)
+        except OSError as e:
+            log.warning(f"couldn't save wad index cache: {e}")
+
+
+# shared by everything that reads wads in this process
+wad_index = WadIndexCache()
@@ -2,4 +2,5 @@
 # from .types import *
 # from .lumps import *
 from .bspfile import *
-from .wadfile import WadFile
\ No newline at end of file
+from .wadfile import WadFile
+from .pakfile import PakFile, PakPath
\ No newline at end of file
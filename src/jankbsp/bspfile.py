@@ -1,8 +1,38 @@
 from struct import Struct
+from mmap import mmap, ACCESS_READ # open_mmap
+from dataclasses import dataclass # probe
 from .enums import Lumps
 from .types import *
 from .lumps import *
 
+# define exceptions
+class BadBspFile(Exception):
+    pass
+
+
+class _ViewReader:
+    ''' minimal read-only file-like object over a buffer, whose read() returns
+        memoryview slices of it instead of copies
+    '''
+    def __init__(self, buffer, name=None):
+        self._view = memoryview(buffer)
+        self._pos = 0
+        self.name = name # of the file, like file objects have
+
+    def seek(self, offset, whence=0):
+        base = (0, self._pos, len(self._view))[whence]
+        self._pos = base + offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        end = len(self._view) if size < 0 else self._pos + size
+        result = self._view[self._pos:end]
+        self._pos += len(result)
+        return result
+
 
 class BspFile:
     HEADER_STRUCT = Struct(f"<i{len(Lumps)*2}i")
@@ -12,7 +42,7 @@ class BspFile:
         Lumps.Planes       : BspPlanesLump,
         Lumps.Textures     : BspTextureLump,
         Lumps.Vertices     : BspVerticesLump,
-        Lumps.Visibility   : BspLump,
+        Lumps.Visibility   : BspVisLump,
         Lumps.Nodes        : BspNodesLump,
         Lumps.Texinfo      : BspTexInfoLump,
         Lumps.Faces        : BspFacesLump,
@@ -25,32 +55,96 @@ class BspFile:
         Lumps.Models       : BspModelsLump
     }
     dirty_texture_encode = True # uses the dirty texture lump encode
+    lazy_decode = False # defer decoding each lump until its entries are read
+    array_backend = False # data lumps decode to numpy/stdlib arrays
 
     def __init__(self, *args, **kwargs):
+        self._mmap = None
         if args or kwargs:
             self.load(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def open_mmap(cls, path, lump_enum=Lumps, lazy=True, arrays=None):
+        ''' loads the bsp off a read-only memory map of the file. every lump's
+            raw data is a memoryview into the map, so nothing is copied until
+            a lump is decoded (and with lazy, only lumps that get accessed).
+
+            the map must outlive anything decoded from it. do not dump back
+            into the same file while it's mapped; use close() when done.
+        '''
+        self = cls()
+        with open(path, "rb") as fp:
+            self._mmap = mmap(fp.fileno(), 0, access=ACCESS_READ)
+        try:
+            return self.load(_ViewReader(self._mmap, str(path)),
+                             lump_enum, lazy, arrays)
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def unpack_header(header, name=None) -> tuple:
+        ''' the version and lump directory values of the header.
+            raises BadBspFile if it isn't a (whole) GoldSrc BSP header
+        '''
+        name = name or "BSP file"
+        if len(header) < BspFile.HEADER_STRUCT.size:
+            raise BadBspFile(f"{name}: file too short for a BSP header")
+        unpacked = BspFile.HEADER_STRUCT.unpack_from(header)
+        if unpacked[0] != BspFile.MAGIC:
+            raise BadBspFile(f"{name}: unsupported BSP version {unpacked[0]} "
+                             f"(expected {BspFile.MAGIC})")
+        return unpacked
+
+    def close(self):
+        ''' releases the memory map, if loaded with open_mmap.
+            if entries decoded from it are still referenced elsewhere, the map
+            is left for the garbage collector to close.
+        '''
+        if self._mmap is None: return
+        try:
+            self._mmap.close()
+        except BufferError: # views into the map still exist
+            pass
+        self._mmap = None
             
-    def load(self, fp, lump_enum=Lumps):
+    def load(self, fp, lump_enum=Lumps, lazy=None, arrays=None):
         ''' a custom lump_enum can be supplied for BSPs that don't use
             default lump enumeration (Blue Shift)
             
+            if lazy (defaults to the lazy_decode class var), lumps are only
+            read as is, and decoded the first time their entries are accessed.
+            lumps that are never accessed are dumped back verbatim.
+
+            if arrays (defaults to the array_backend class var), data lumps
+            decode to numpy structured arrays instead of lists of dataclasses.
+
             (implementation note: use Lumps[lump_enum[x].name] to translate to 
             normal lumps)
         '''
-        header = fp.read(BspFile.HEADER_STRUCT.size)
-        unpacked = BspFile.HEADER_STRUCT.unpack_from(header)
+        if lazy is None: lazy = self.lazy_decode
+        if arrays is not None: self.array_backend = arrays
+        unpacked = BspFile.unpack_header(fp.read(BspFile.HEADER_STRUCT.size),
+                                         getattr(fp, "name", None))
         self.version = unpacked[0]
-        assert self.version == BspFile.MAGIC
 
         # use the member of enum Lumps to access member of these dicts
         self.lumps = {}
         # dict of [enum] = offset. used to determine order of lumps
         lump_order_dict = {}
+        # dict of [enum] = (offset, length) as read from the header
+        self._lump_dir = {}
         for i, lump_member in enumerate(lump_enum):
             lump_member_translated = Lumps[lump_member.name]
             lump_offset = unpacked[2*i+1]
             lump_length = unpacked[2*i+2]
             lump_order_dict[lump_member_translated] = lump_offset
+            self._lump_dir[lump_member_translated] = (lump_offset, lump_length)
 
             fp.seek(lump_offset)
             if lump_member_translated in self.__class__.LUMPCLASSES:
@@ -59,7 +153,7 @@ class BspFile:
                 lump_cls = BspLump
                 
             self.lumps[lump_member_translated] = lump_cls(self)
-            self.lumps[lump_member_translated].load(fp,lump_length)
+            self.lumps[lump_member_translated].load(fp,lump_length,lazy)
 
         self._lump_order = list(l for l in sorted(lump_order_dict.items(), \
                 key=lambda item: item[1]))
@@ -94,12 +188,27 @@ class BspFile:
         fp.seek(0)
         fp.write(header)
     
+    def patch(self, fp):
+        ''' writes texture renames in place, given fp opened in r+b mode on the
+            file this bsp was loaded from. only the 16-byte name field of each
+            renamed miptex is written; everything else is left untouched.
+
+            returns the number of bytes written, or None if other edits were
+            made, in which case use dump() instead.
+        '''
+        for lumpenum, lump in self.lumps.items():
+            if lumpenum != Lumps.Textures and lump.dirty:
+                return None
+        lump_offset = self._lump_dir[Lumps.Textures][0]
+        return self.lumps[Lumps.Textures].patch(fp, lump_offset)
+
     def clone(self, fp):
         ''' returns a new instance of the bsp file by way of dumping to a buffer,
             then loading a new instance off that buffer 
         '''
         self.dump(fp)
-        cloned = PakFile().load(fp)
+        fp.seek(0)
+        cloned = self.__class__().load(fp)
         return cloned
     
     @property
@@ -172,3 +281,31 @@ class BspFileBasic(BspFile):
     def surfedges(self): return None
     @property
     def models(self): return None
+
+
+@dataclass
+class BspProbe:
+    ''' what probe() reads off a bsp: the lump directory and the entities '''
+    version: int
+    lump_dir: dict # [Lumps] = (offset, length)
+    entities: EntityList
+
+    @property
+    def wads(self) -> tuple:
+        ''' wad paths listed in worldspawn '''
+        if not self.entities or "wad" not in self.entities[0]: return tuple()
+        return tuple(wad for wad in self.entities[0]["wad"].split(";") if wad)
+
+def probe(path, lump_enum=Lumps) -> BspProbe:
+    ''' reads only the header and the entity lump of the bsp at path, for
+        when the rest of the file isn't needed (wad lists, remap entities)
+    '''
+    with open(path, "rb") as fp:
+        unpacked = BspFile.unpack_header(fp.read(BspFile.HEADER_STRUCT.size), path)
+        version = unpacked[0]
+        lump_dir = {Lumps[lump_member.name]: unpacked[2*i+1:2*i+3]
+                    for i, lump_member in enumerate(lump_enum)}
+        offset, length = lump_dir[Lumps.Entities]
+        fp.seek(offset)
+        entities = EntityList.decode(fp.read(length))
+    return BspProbe(version, lump_dir, entities)
@@ -62,3 +62,8 @@ class Contents(IntEnum):
     Current_Up   = -13
     Current_Down = -14
     Translucent  = -15
+
+@unique
+class MipFilter(IntEnum):
+    Point = auto() # samples the center pixel of each block
+    Box   = auto() # averages the colors of each block
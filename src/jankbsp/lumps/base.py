@@ -1,55 +1,144 @@
-from hashlib import md5 # to check if lump has changed
-from io import BytesIO # temp place to dump
+from array import array # array backend fallback
 from jankbsp.types import *
+from jankbsp.types.structs import struct_dtype
+import sys
+try:
+    import numpy as np # optional, for the array backend
+except ImportError:
+    np = None
+
+class _RawComparer:
+    ''' file-like sink that checks what's written to it against a buffer,
+        raising Mismatch at the first difference
+    '''
+    class Mismatch(Exception):
+        pass
+
+    def __init__(self, raw):
+        self._view = memoryview(raw).cast("B")
+        self.pos = 0
+
+    def write(self, data):
+        end = self.pos + len(data)
+        # as bytes, which compare with memcmp (memoryviews go item by item)
+        if end > len(self._view) or self._view[self.pos:end].tobytes() != bytes(data):
+            raise _RawComparer.Mismatch
+        self.pos = end
+        return len(data)
+
 
 class BspLump:
-    ''' most basic lump implementation that just loads/dumps raw data as is. '''
+    ''' most basic lump implementation that just loads/dumps raw data as is.
+
+        subclasses parse self._raw in decode(), which sets self.entries.
+        if loaded lazily, decode() is deferred until entries is first read,
+        and a lump that is never decoded is dumped back verbatim.
+
+        a decoded lump is dirty once its entries are edited (see _state), and
+        only then re-encoded on dump. clean lumps are dumped as read.
+    '''
     
     def __init__(self, parent):
         # each lump must be initialized with the reference to its parent BspFile
         self._parent = parent # the parent BspFile
+        self._entries = None
+        self._decoded = False
+        self._dirty = False
+        self._clean_state = None
 
-    def load(self, fp, length):
+    def load(self, fp, length, lazy=False):
+        self._offset = fp.tell()
         self._length = length
         self._raw = fp.read(length)
+        if not lazy:
+            self.decode()
         return self
 
+    def decode(self):
+        ''' parses self._raw into self.entries. nothing to parse here '''
+        self._mark_clean()
+        return self
+
+    def _mark_clean(self):
+        ''' marks the lump as decoded, with entries matching self._raw '''
+        self._decoded = True
+        self._dirty = False
+        self._clean_state = self._state()
+
+    def _state(self):
+        ''' returns a token that changes whenever the entries are edited.
+            None means edits can't be tracked, so decoded entries are always
+            considered dirty
+        '''
+        return id(self._raw)
+
     def dump(self, fp):
         return fp.write(self._raw)
 
-    def _hash(self, raw=False, target=None, dumpargs=(),dumpkwargs={}):
-        # calculates md5 hash from the raw or the dump
-        h = md5()
-        if raw: target=self._raw
-        if target is not None:
-            h.update(target)
-            return h.digest()
-        with BytesIO() as f:
-            self.dump(f, *dumpargs, **dumpkwargs)
-            h.update(f.getbuffer())
-            return h.digest()
+    @property
+    def decoded(self):
+        return self._decoded
+
+    @property
+    def entries(self):
+        if not self._decoded:
+            self.decode()
+        return self._entries
+    @entries.setter
+    def entries(self, value):
+        self._entries = value
+
+    def mark_dirty(self):
+        ''' flags the lump to be re-encoded on dump, for edits that can't be
+            tracked otherwise
+        '''
+        self._dirty = True
 
     @property
-    def changed(self):
-        return self._hash() != self._hash(raw=True)
+    def dirty(self):
+        if not self._decoded: return False # never decoded, never edited
+        if self._dirty: return True
+        state = self._state()
+        return state is None or state != self._clean_state
+
+    @property
+    def changed(self): # old name
+        return self.dirty
 
 
 class BspDataLump(BspLump):
     ''' extended BspLump for lumps that hold an array of objects, no headers
         DATATYPE must have "STRUCT" Struct property and "encode"/"decode" method
         if DATATYPE is generic type, class must have STRUCT for a single type
+
+        if the parent BspFile has array_backend set, entries is instead a numpy
+        structured array (see decode_array), dumped back with tobytes()
+
+        entries can be edited in place without notice, so once decoded, a data
+        lump is dirty when its entries no longer encode to the bytes read.
     '''
     DATATYPE = Vector # example
+    CHUNK_SIZE = 65536 # max bytes packed at a time on dump
 
-    def load(self, fp, length):
+    def load(self, fp, length, lazy=False):
         cls = self.__class__
         data_struct = cls.STRUCT if hasattr(cls,"STRUCT") else cls.DATATYPE.STRUCT
         
         # make sure length is exact multiples of struct size
         assert not length % data_struct.size
 
-        self = super().load(fp, length)
+        return super().load(fp, length, lazy)
 
+    def decode(self):
+        cls = self.__class__
+        if getattr(self._parent, "array_backend", False) \
+        and (entries := self.decode_array()) is not None:
+            self.entries = entries
+            self._mark_clean()
+            return self
+
+        data_struct = cls.STRUCT if hasattr(cls,"STRUCT") else cls.DATATYPE.STRUCT
+        length = len(self._raw)
         size = data_struct.size
         if hasattr(cls,"STRUCT"):
             self.entries = [item[0] for item in cls.STRUCT.iter_unpack(self._raw)]
@@ -59,14 +148,81 @@ class BspDataLump(BspLump):
                 for offset in range(0,length,size)
             ]
 
+        self._mark_clean()
         return self
 
+    def _state(self):
+        return None # untracked, see dirty
+
+    @property
+    def dirty(self):
+        ''' entries can be edited in place without notice, so a decoded data
+            lump is dirty once they no longer encode to the bytes read
+        '''
+        if not self._decoded: return False
+        if self._dirty: return True
+        sink = _RawComparer(self._raw)
+        try:
+            self._encode_to(sink)
+        except _RawComparer.Mismatch:
+            return True
+        return sink.pos != len(self._raw)
+
+    @classmethod
+    def dtype(cls):
+        ''' numpy dtype of a single entry, or None if numpy isn't available '''
+        if "_dtype" not in cls.__dict__:
+            cls._dtype = struct_dtype(cls.STRUCT) if hasattr(cls,"STRUCT") \
+                    else struct_dtype(cls.DATATYPE.STRUCT, cls.DATATYPE.DTYPE_FIELDS)
+        return cls._dtype
+
+    def decode_array(self):
+        ''' returns the entries as a numpy (structured) array built straight
+            off the raw data. without numpy, lumps of a single value type
+            (e.g. marksurfaces, surfedges) fall back to a stdlib array.
+            returns None if neither is possible.
+        '''
+        cls = self.__class__
+        if (dtype := cls.dtype()) is not None:
+            return np.frombuffer(self._raw, dtype=dtype).copy() # writable
+        if not hasattr(cls,"STRUCT") or len(cls.STRUCT.format.lstrip("<")) != 1:
+            return None
+
+        entries = array(cls.STRUCT.format[-1])
+        if entries.itemsize != cls.STRUCT.size: # native size differs
+            return None
+        entries.frombytes(self._raw)
+        if sys.byteorder == "big": entries.byteswap()
+        return entries
+
     def dump(self, fp):
+        if not self.dirty:
+            return super().dump(fp)
+        return self._encode_to(fp)
+
+    def _encode_to(self, fp):
+        ''' writes the encoded entries to fp, returning the bytes written '''
         cls = self.__class__
-        if hasattr(cls,"STRUCT"):
-            #print(cls,"packing using struct")
-            return fp.write(b"".join([cls.STRUCT.pack(item) for item in self.entries]))
-        elif hasattr(cls.DATATYPE, "encode"):
-            #print(cls,"packing using encode method of", cls.DATATYPE)
-            return fp.write(b"".join([item.encode() for item in self.entries]))
+        size = cls.STRUCT.size if hasattr(cls,"STRUCT") else cls.DATATYPE.STRUCT.size
+        # entries are written a chunk at a time, packed into a reused buffer
+        count = max(1, cls.CHUNK_SIZE // size)
+        buffer = bytearray(count * size)
+        written = 0
+        for start in range(0, len(self.entries), count):
+            chunk = self.entries[start:start+count]
+            if isinstance(chunk, array):
+                if sys.byteorder == "big": chunk.byteswap() # slice is a copy
+                written += fp.write(chunk.tobytes())
+                continue
+            elif np is not None and isinstance(chunk, np.ndarray):
+                written += fp.write(chunk.tobytes())
+                continue
+            elif hasattr(cls,"STRUCT"):
+                for i, item in enumerate(chunk):
+                    cls.STRUCT.pack_into(buffer, i*size, item)
+            else:
+                for i, item in enumerate(chunk):
+                    item.encode_into(buffer, i*size)
+            written += fp.write(memoryview(buffer)[0:len(chunk)*size])
+        return written
 
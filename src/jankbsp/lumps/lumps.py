@@ -1,23 +1,39 @@
 from .base import BspLump, BspDataLump
-from itertools import pairwise, accumulate # for texturelump
+import re # vislump
+from itertools import pairwise, accumulate, islice # for texturelump
 from math import ceil # vislump
-from operator import itemgetter, attrgetter
+from operator import itemgetter
 from struct import Struct
 from collections.abc import MutableSequence # for lightmap view
+from numbers import Integral # get_faces_of
 from jankbsp.types import *
 from jankbsp.enums import Lumps
 
+def _fields(entry, *names):
+    ''' the named values of a data lump entry, which is a dataclass, or a
+        numpy record if the BspFile has array_backend set (the dtype fields
+        are named after the dataclass fields)
+    '''
+    if hasattr(entry, "dtype"):
+        return tuple(entry[name] for name in names)
+    return tuple(getattr(entry, name) for name in names)
+
 class BspEntityLump(BspLump):
     ''' entity lump
         extended to provide a MultiDict interface for the entity data
     '''
-    def load(self, fp, length):
-        super().load(fp, length)
+    def decode(self):
         self.entries = EntityList.decode(self._raw)
+        self._mark_clean()
         return self
 
+    def _state(self):
+        return (id(self._entries), self._entries.state)
+
     def dump(self, fp):
-        return fp.write(self.entries.encode())
+        if not self.dirty:
+            return super().dump(fp)
+        return self.entries.dump(fp)
 
 
 class BspPlanesLump(BspDataLump):
@@ -28,12 +44,10 @@ class BspPlanesLump(BspDataLump):
 class BspTextureLump(BspLump):
     ''' textures lump '''
     
-    def load(self, fp, length):
-        """ loads texture data
+    def decode(self):
+        """ decodes texture data
             this fn assumes that the texture entries are sequential and tightly packed
         """
-        super().load(fp, length) # reads to self._raw. don't read fp after this!
-
         count = int.from_bytes(self._raw[0:4],byteorder='little')
         # entry offsets + the length at the end
         # this would be iterated pairwise to extract the raw bytes for each entry
@@ -45,31 +59,71 @@ class BspTextureLump(BspLump):
                 ) for i in range(count)
         ] + [len(self._raw)]
 
-        self.entries = []
-        for start, end in pairwise(boundaries):
-            self.entries.append(MipTex.decode(self._raw[start:end]))
-
-        # calculate the hash of the dumped data as is, since it's impossible to
-        # get the same hash as the raw data due to how texture names are stored
-        # self._inithash = self._hash()
+        self.entries = [MipTex.decode(self._raw[start:end]) \
+                        for start, end in pairwise(boundaries)]
+        # where each entry sits in the lump, and what it looked like when read.
+        # used by patch() to tell renames apart from other edits
+        self._entry_offsets = boundaries[:-1]
+        self._entry_layouts = [self._layout_of(entry) for entry in self._entries]
 
+        self._mark_clean()
         return self
 
-    def dump(self, fp, dirty_encode=False, raw_if_unchanged=False):
-        ''' dump textures
+    def _state(self):
+        # miptexes bump their version on every edit
+        return (id(self._entries),
+                tuple((id(entry), entry.version) for entry in self._entries))
+
+    def dump(self, fp, dirty_encode=False):
+        ''' dump textures, as read if none were edited
             dirty_encode pastes the texture name over the garbage as read
         '''
-        if raw_if_unchanged and not self.changed:
-            return fp.write(self._raw)
+        if not self.dirty:
+            return super().dump(fp)
 
+        # offsets are worked out from the calculated sizes, so that each entry
+        # can be written out as it's encoded
         front_size = len(self.entries) * 4 + 4
-        entry_data = [entry.encode(dirty_encode) for entry in self.entries]
-        entry_offsets = [0] + list(accumulate([len(data) for data in entry_data]))
-        entry_offsets = [x+front_size for x in entry_offsets[0:len(self.entries)] ]
-        front_data = [len(entry_data).to_bytes(4,byteorder='little')] \
+        # (one offset per entry; none at all for an empty lump)
+        entry_offsets = islice(accumulate([entry.size for entry in self.entries],
+                                          initial=front_size), len(self.entries))
+        front_data = [len(self.entries).to_bytes(4,byteorder='little')] \
                 + [x.to_bytes(4,byteorder='little',signed=True) for x in entry_offsets]
 
-        return fp.write(b"".join(front_data + entry_data))
+        written = fp.write(b"".join(front_data))
+        for entry in self.entries:
+            written += entry.dump(fp, dirty_encode)
+        return written
+
+    @staticmethod
+    def _layout_of(entry):
+        ''' the parts of a miptex that, if edited, would move data in the lump
+            (compared by identity, so any reassignment counts as an edit)
+        '''
+        return (entry, entry.is_external, entry.width, entry.height,
+                entry.mip0, entry.palette)
+
+    def patch(self, fp, lump_offset):
+        ''' writes the name fields of renamed entries in place, given fp opened
+            in r+b mode on the file this lump was read from at lump_offset.
+            returns number of bytes written, or None if entries were edited in
+            other ways, in which case the lump has to be dumped in full.
+        '''
+        if not self.dirty: return 0 # nothing renamed
+        if len(self.entries) != len(self._entry_layouts): return None
+
+        for entry, layout in zip(self.entries, self._entry_layouts):
+            if any(a is not b for a, b in zip(self._layout_of(entry), layout)):
+                return None
+
+        written = 0
+        for offset, entry in zip(self._entry_offsets, self.entries):
+            namefield = entry.encode_name(True)
+            if namefield == entry._rawname: continue
+            fp.seek(lump_offset + offset) # name is the first field in miptex
+            written += fp.write(namefield)
+            entry._rawname = namefield
+        return written
 
     @property
     def embedded_entries(self): # Read-only!
@@ -77,11 +131,6 @@ class BspTextureLump(BspLump):
     @property
     def external_entries(self): # Read-only!
         return list(filter(lambda tex:tex.is_external,self.entries))
-    @property
-    def changed(self):
-        #return self._hash() != self._inithash
-        # dump with dirty encode enabled. should give identical hash to _raw
-        return self._hash(dumpargs=(True)) != self._hash(raw=True)
 
 
 class BspVerticesLump(BspDataLump):
@@ -89,28 +138,101 @@ class BspVerticesLump(BspDataLump):
     DATATYPE = Vector
 
 class BspVisLump(BspLump):
-    ''' visibility lump 
-        no unpacking the PVS on load since apparently the algo is fast enough
-        (also because we don't know the leaf count)
+    ''' visibility lump
+        the PVS rows of every leaf get decompressed together on the first query
+        into one bit-packed matrix (a bytearray of row_size bytes per row),
+        which is cached on the lump. rows are keyed by their visleaf offset.
+        bit j of a row stands for leaf j+1, since leaf 0 is the outside leaf
     '''
-    def unpack_pvs_bytes(self,start,len) -> bytes:
+    # a literal run of nonzero bytes, or a zero byte followed by its count
+    RUN_RE = re.compile(rb"\x00(.)|[^\x00]+", re.S)
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self._matrix = None
+        self._rows = None # visleaf offset -> row start in the matrix
+        self._row_size = 0
+        self._count = 0 # visleaf_count as of build_matrix
+
+    def unpack_pvs_bytes(self, start, count) -> bytes:
         ''' PVS unpack
             start is the byte offset
-            len is the number of bits/leaves to unpack
+            count is the number of bits/leaves to unpack
+        '''
+        row_size = ceil(count/8)
+        result = bytearray()
+        for run in self.RUN_RE.finditer(self._raw, start):
+            if run[1] is None: # filled bytes
+                result += run[0]
+            else: # empty bytes, the next byte counts them
+                result += bytes(run[1][0])
+            if len(result) >= row_size: break
+        del result[row_size:]
+        return bytes(result.ljust(row_size, b"\x00"))
+
+    @property
+    def visleaf_count(self) -> int:
+        ''' number of leaves covered by the PVS (world leaves minus leaf 0) '''
+        models = self._parent.lumps[Lumps.Models]
+        if len(models._raw):
+            return BspModel.STRUCT.unpack_from(models._raw)[13]
+        leaves = self._parent.lumps[Lumps.Leafs]
+        return max(len(leaves._raw) // BspLeaf.STRUCT.size - 1, 0)
+
+    def build_matrix(self):
+        ''' decompresses the rows of all leaves into the matrix in one pass '''
+        self._count = self.visleaf_count
+        self._row_size = ceil(self._count/8)
+        leaves = self._parent.lumps[Lumps.Leafs]
+        offsets = sorted({values[1] for values
+                          in BspLeaf.STRUCT.iter_unpack(leaves._raw)
+                          if values[1] >= 0})
+        matrix = bytearray()
+        rows = {}
+        for offset in offsets:
+            rows[offset] = len(matrix)
+            matrix += self.unpack_pvs_bytes(offset, self._count)
+        self._matrix, self._rows = matrix, rows
+        return matrix
+
+    @property
+    def matrix(self) -> bytearray:
+        if self._matrix is None:
+            self.build_matrix()
+        return self._matrix
+
+    @property
+    def row_size(self) -> int:
+        if self._matrix is None:
+            self.build_matrix()
+        return self._row_size
+
+    def get_row(self, visleaf) -> bytes:
+        ''' bit-packed PVS row of the leaf with the given visleaf offset '''
+        matrix = self.matrix
+        if visleaf not in self._rows: # not referenced by any leaf
+            self._rows[visleaf] = len(matrix)
+            matrix += self.unpack_pvs_bytes(visleaf, self._count)
+        start = self._rows[visleaf]
+        return bytes(matrix[start:start+self._row_size])
+
+    def is_visible(self, visleaf, leaf_index) -> bool:
+        ''' whether leaf_index is in the PVS of the leaf at visleaf '''
+        if visleaf < 0 or not len(self._raw): return True
+        row = self.get_row(visleaf)
+        if not 0 < leaf_index <= self._count: return False
+        bit = leaf_index - 1
+        return bool(row[bit >> 3] & (1 << (bit & 7)))
+
+    def visible_leaf_indices(self, visleaf) -> list:
+        ''' indices of the leaves in the PVS of the leaf at visleaf.
+            the bits past visleaf_count in the last byte are padding, which
+            compilers don't necessarily leave zeroed
         '''
-        result = b"\x00" * ceil(len/8)
-        v = start;
-        l = 0
-        while l < len:
-            if self._raw[v]: # filled byte
-                result[v-start] = self._raw[v]
-                l += 8
-                v += 1
-            else: # empty byte, skip bytes
-                # next byte represents number of zero bytes
-                l += 8 * int.from_bytes(self._raw[v+1])
-                v += 2 # skip the byte that counts zero bytes in data
-        return result
+        row = self.get_row(visleaf)
+        return [index for i, byte in enumerate(row) if byte
+                for bit in range(8) if byte & (1 << bit)
+                if (index := (i << 3) + bit + 1) <= self._count]
 
 class BspNodesLump(BspDataLump):
     ''' nodes lump '''
@@ -141,22 +263,17 @@ class BspLeavesLump(BspDataLump):
         ''' returns leaves visible from the given leaf '''
         if not len(self._parent.visdata): # no vis data
             return self.entries # everything is visible
-        elif leaf.visleaf < 0:
+        elif (visleaf := _fields(leaf, "visleaf")[0]) < 0:
             return self.entries # everything is visible from here
         # else
-        result = []
-        pvs_bytes = self._parent.lumps[Lumps.Visibility]\
-            .unpack_pvs_bytes(leaf.visleaf, len(self.entries))
-        for l in range(len(self.entries)):
-            if pvs_bytes[l//8]&(l%8):
-                result.append(self.entries[l])
-        return result
+        entries = self.entries
+        return [entries[l] for l in self._parent.lumps[Lumps.Visibility]\
+            .visible_leaf_indices(visleaf) if l < len(entries)]
     
     def get_faces(self, leaf):
+        start,count = _fields(leaf, "marksurface_index", "marksurface_count")
         return itemgetter(
-            *self._parent.marksurfaces[\
-                leaf.marksurface_index:leaf.marksurface_index+leaf.marksurface_count\
-            ]
+            *self._parent.marksurfaces[start:start+count]
         )(self._parent.faces)
 
 class BspMarksurfacesLump(BspDataLump):
@@ -170,7 +287,7 @@ class BspEdgesLump(BspDataLump):
         ''' negative index reverses the edge order
             basically surfedges translates to this.
         '''
-        indices = self._parent.edges[abs(index)].astuple()
+        indices = _fields(self._parent.edges[abs(index)], "index1", "index2")
         values = itemgetter(*indices)(self._parent.vertices)
         if index < 0:
             values = reversed(values)
@@ -186,6 +303,6 @@ class BspModelsLump(BspDataLump):
     
     def get_faces_of(self, item:BspModel|int):
         ''' return faces of given model index '''
-        item = self.entries[item] if isinstance(item,int) else item
-        start,count = attrgetter("face_index","face_count")(item)
+        item = self.entries[item] if isinstance(item,Integral) else item
+        start,count = _fields(item, "face_index", "face_count")
         return self._parent.faces[start:start+count]
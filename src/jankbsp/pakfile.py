@@ -1,40 +1,172 @@
-''' 
+'''
 PAK file library.
 This implementation will try to emulate the classes and methods of ZipFile.
 
 Notable differences:
     ZipInfo -> PakDirEntry
-    
+    read() returns a memoryview into the memory-mapped pak instead of a copy
+    read-only
+
 '''
 from .types.pak import PakHeader, PakDirEntry, BadPakFile
+from .bspfile import _ViewReader # open
 from dataclasses import dataclass, field, astuple
 from pathlib import Path, PurePath
 from contextlib import AbstractContextManager
+from mmap import mmap, ACCESS_READ
+import io, re
 
 def is_pakfile(filename):
-    with open(filename, "rb") as fp:
-        data = fp.read(PakHeader.STRUCT.size)
-        unpacked = PakHeader.STRUCT.unpack_from(data,0)
-        return unpacked[0] == PakHeader.MAGICVAL
+    try:
+        with open(filename, "rb") as fp:
+            data = fp.read(PakHeader.STRUCT.size)
+    except OSError:
+        return False
+    if len(data) < PakHeader.STRUCT.size: return False
+    unpacked = PakHeader.STRUCT.unpack_from(data,0)
+    return unpacked[0] == PakHeader.MAGICVAL
+
+def _normalize(name):
+    return name.replace("\\", "/").lower()
 
 class PakFile(AbstractContextManager):
+    ''' read-only pak file, memory-mapped. member names are looked up
+        case-insensitively, with either kind of slash
+    '''
     def __init__(self, filename, mode="r"):
-        self._file = filename
+        if mode != "r":
+            raise ValueError("PakFile can only be opened in 'r' mode")
+        self.filename = Path(filename)
         self._mode = mode
         with open(filename, "rb") as fp:
-            header = PakHeader.load(fp)
-            
-            fp.seek(header.dir_offset)
-            size, count = PakHeader.STRUCT.size, header.entries
-            dir_raw = fp.read(size * count) # read once
+            self._mmap = mmap(fp.fileno(), 0, access=ACCESS_READ)
+        try:
+            header = PakHeader.decode(self._mmap[0:PakHeader.STRUCT.size])
+            size, count = PakDirEntry.STRUCT.size, header.entries
+            dir_raw = self._mmap[header.dir_offset:header.dir_offset+size*count]
             self._entries = [\
                     PakDirEntry.decode(dir_raw[n*size:n*size+size]) \
                     for n in range(count)\
             ]
-        return self
-    def __enter__(self, *args, **kwargs):
-        return self
+        except Exception:
+            self._mmap.close()
+            raise
+        self._index = {}
+        for entry in self._entries: # first one wins, like in the engine
+            self._index.setdefault(_normalize(entry.name), entry)
+
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
-    
-    
\ No newline at end of file
+
+    def close(self):
+        ''' releases the memory map. if views from read() are still
+            referenced, the map is left for the garbage collector to close.
+        '''
+        if self._mmap is None: return
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._mmap = None
+
+    def namelist(self) -> list[str]:
+        return [entry.name for entry in self._entries]
+
+    def infolist(self) -> list[PakDirEntry]:
+        return list(self._entries)
+
+    def getinfo(self, name) -> PakDirEntry:
+        return self._index[_normalize(name)] # raises KeyError
+
+    def __contains__(self, name):
+        return _normalize(name) in self._index
+
+    def read(self, name) -> memoryview:
+        ''' contents of the member, as a view into the map '''
+        entry = name if isinstance(name, PakDirEntry) else self.getinfo(name)
+        return memoryview(self._mmap)[entry.offset:entry.offset+entry.size]
+
+    def open(self, name, mode="r"):
+        ''' binary file-like object over the member. read() returns views '''
+        if mode not in ("r", "rb"):
+            raise ValueError("PakFile members can only be opened in 'r' mode")
+        return _ViewReader(self.read(name))
+
+
+@dataclass(frozen=True)
+class PakPath:
+    ''' a member of a pak, addressed as though the pak were extracted in the
+        folder it's in (like zipfile.Path, but overlaid on that folder).
+        so the path parts read like a normal path: mod/sound/materials.txt
+    '''
+    pak: Path
+    at: str
+
+    @property
+    def _virtual(self) -> PurePath:
+        return PurePath(self.pak.parent, self.at)
+
+    def __str__(self):
+        return str(self.pak / self.at)
+
+    @property
+    def name(self): return self._virtual.name
+    @property
+    def suffix(self): return self._virtual.suffix
+    @property
+    def stem(self): return self._virtual.stem
+    @property
+    def parent(self): return self._virtual.parent
+    @property
+    def parents(self): return self._virtual.parents
+
+    def with_name(self, name):
+        return PakPath(self.pak, str(PurePath(self.at).with_name(name)))
+
+    def exists(self):
+        try:
+            with PakFile(self.pak) as pak:
+                return self.at in pak
+        except (OSError, BadPakFile):
+            return False
+
+    def stat(self):
+        return self.pak.stat() # the member changes only with the pak
+
+    def resolve(self):
+        return PakPath(self.pak.resolve(), self.at)
+
+    def read_bytes(self) -> bytes:
+        with PakFile(self.pak) as pak:
+            with pak.read(self.at) as view:
+                return bytes(view)
+
+    def read_text(self, encoding=None, errors=None) -> str:
+        return self.read_bytes().decode(encoding or "utf-8", errors or "strict")
+
+    def open(self, mode="r", encoding=None, errors=None):
+        ''' the member's contents as a file object (copied off the pak) '''
+        buffer = io.BytesIO(self.read_bytes())
+        if "b" in mode: return buffer
+        return io.TextIOWrapper(buffer, encoding, errors)
+
+
+def iter_paks(folder):
+    ''' pakN.pak files of the folder, in the order the engine searches them
+        (highest N first)
+    '''
+    paks = []
+    for path in Path(folder).glob("*.[pP][aA][kK]"):
+        if m := re.fullmatch(r"(?i)pak(\d+)\.pak", path.name):
+            paks.append((int(m[1]), path))
+    return [path for _, path in sorted(paks, reverse=True)]
+
+def find_in_paks(folder, name) -> PakPath|None:
+    ''' the first pak of the folder having the member, as a PakPath '''
+    for path in iter_paks(folder):
+        try:
+            with PakFile(path) as pak:
+                if name in pak: return PakPath(path, pak.getinfo(name).name)
+        except (OSError, BadPakFile, ValueError):
+            continue # unreadable or empty file
+    return None
@@ -1,3 +1,3 @@
 from .structs import *
-from .entitylist import EntityList
+from .entitylist import EntityList, Entity
 from .miptex import MipTex
@@ -1,141 +1,461 @@
 import re
 from typing import *
-from collections import UserList, UserDict
+from collections import UserList
+from functools import lru_cache # query_select
+from itertools import count # _EntityData
+from weakref import ref # _EntityData
+import sys # intern
 # from .multidict import MultiDict
 
+_COMMON_KEYS = ("classname", "targetname", "target", "origin", "angles",
+                "angle", "spawnflags", "model", "wad", "rendermode", "renderamt",
+                "rendercolor", "renderfx", "_light", "style", "killtarget")
+
+class Entity(dict):
+    ''' dict of an entity's key/values, with a version bumped on every edit.
+        edits to INDEXED_KEYS also restamp the EntityList.data lists holding
+        the entity, so only their indexes get rebuilt
+    '''
+    version = 0
+    INDEXED_KEYS = frozenset(("classname", "targetname", "model"))
+
+    def __getstate__(self): # copies and pickles aren't held by any list yet
+        state = self.__dict__.copy()
+        state.pop("_owners", None)
+        return state
+
+    def _edited(self, keys):
+        self.version += 1
+        if Entity.INDEXED_KEYS.isdisjoint(keys): return
+        for ref in self.__dict__.get("_owners", {}).values():
+            if (owner := ref()) is not None: owner.stamp = next(_stamps)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._edited((key,))
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._edited((key,))
+
+    # dict's own mutators don't go through __setitem__/__delitem__
+    def update(self, *args, **kwargs):
+        items = dict(*args, **kwargs)
+        super().update(items)
+        self._edited(items)
+
+    def setdefault(self, key, default=None):
+        if key not in self: self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self: return super().pop(key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._edited((item[0],))
+        return item
+
+    def clear(self):
+        keys = list(self)
+        super().clear()
+        self._edited(keys)
+
+
+_stamps = count(1)
+
+class _EntityData(list):
+    ''' EntityList.data: a list that takes a new stamp on every change, so
+        the indexes can tell they're stale even if it's edited directly.
+        the Entity items it's given hold on to it (weakly), to restamp it
+        when their indexed keys are edited
+    '''
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._changed(self)
+
+    def __reduce__(self): # a fresh stamp when unpickled
+        return (self.__class__, (list(self),))
+
+    def _changed(self, added=()):
+        self.stamp = next(_stamps)
+        for item in added:
+            if isinstance(item, Entity): # lists aren't hashable, key by id
+                item.__dict__.setdefault("_owners", {})[id(self)] = ref(self)
+
+    def append(self, item):
+        self._changed((item,))
+        super().append(item)
+
+    def insert(self, i, item):
+        self._changed((item,))
+        super().insert(i, item)
+
+    def extend(self, items):
+        items = list(items) # may be a generator, which reads only once
+        self._changed(items)
+        super().extend(items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __setitem__(self, i, item):
+        if isinstance(i, slice):
+            item = list(item)
+            self._changed(item)
+        else:
+            self._changed((item,))
+        super().__setitem__(i, item)
+
+def _stamping(name):
+    method = getattr(list, name)
+    def wrapper(self, *args, **kwargs):
+        self._changed()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ("pop", "remove", "clear", "sort", "reverse", "__delitem__",
+              "__imul__"):
+    setattr(_EntityData, _name, _stamping(_name))
+
+
 class EntityList(UserList):
     ''' list class extended to add encode/decode for the entity lump '''
     CP = "cp1252"
+    # an entity block: anything up to the closing brace, quoted strings
+    # running until the next quote like in the engine (so they can hold
+    # newlines and braces)
+    BLOCK_RE = re.compile(r'\{((?:[^{}"]++|"[^"]*+")*+)\}')
+    # what a block normally holds: quoted key/value pairs only
+    PAIRS_RE = re.compile(r'(?:\s*"[^"]*"\s*"[^"]*")*\s*')
+    # a key/value pair line, for everything else (comments, lone keys, ...)
     RE = re.compile(r"\"(?P<key>[^\"]*)\"\s+\"(?P<value>[^\"]*)\"")
-    dict_factory = UserDict
+    dict_factory = Entity
+
+    @property
+    def data(self) -> list:
+        return self.__dict__["data"]
+
+    @data.setter
+    def data(self, value):
+        self.__dict__["data"] = value if isinstance(value, _EntityData) \
+                                else _EntityData(value)
+
+    def __copy__(self):
+        inst = super().__copy__() # copies .data as a plain list
+        inst.data = inst.__dict__["data"]
+        return inst
 
     @classmethod
     def decode(cls, bytes):
         self = cls()
+        factory = cls.dict_factory
+        # keys and most values repeat across entities (classname, origin,
+        # "0", ...), so every entity shares the first copy of each string
+        intern = cls.string_table().setdefault
+        # str() rather than .decode() so that memoryviews can be read too
+        text = str(bytes, cls.CP)
+        end = 0
+        for m in cls.BLOCK_RE.finditer(text):
+            if text[end:m.start()].strip(" \t\r\n\x00"):
+                # stray text between blocks, leave it to the line parser
+                return cls._decode_lines(text)
+            end = m.end()
+            block = m[1]
+            if cls.PAIRS_RE.fullmatch(block):
+                # quoted strings are every other piece, alternating key and value
+                pieces = block.split('"')[1::2]
+            else: # keep the valid pairs, line by line
+                pieces = [piece for line in block.splitlines()
+                          if (pair := cls.RE.match(line.strip()))
+                          for piece in pair.groups()]
+            strings = map(intern, pieces, pieces)
+            self.data.append(factory(zip(strings, strings)))
+        if text[end:].strip(" \t\r\n\x00"):
+            return cls._decode_lines(text)
+        return self
 
+    @classmethod
+    def _decode_lines(cls, text):
+        ''' the line by line parser, for lumps the block pattern can't make
+            sense of (e.g. unbalanced quotes or braces)
+        '''
+        self = cls()
+        intern = cls.string_table().setdefault
         current_obj = None
-        for i, line in enumerate(bytes.decode(EntityList.CP).splitlines()):
-            line_re = EntityList.RE.match(line)
+        for line in text.splitlines():
+            line = line.strip()
             if line == "{":
-                if current_obj:
-                    self.append(current_obj)
+                if current_obj is not None:
+                    self.data.append(current_obj)
                 current_obj = cls.dict_factory()
             elif line == "}":
-                self.append(current_obj)
+                if current_obj is not None:
+                    self.data.append(current_obj)
                 current_obj = None
+            elif current_obj is not None and (pair := cls.RE.match(line)):
+                key, value = pair.groups()
+                current_obj[intern(key, key)] = intern(value, value)
+        if current_obj is not None:
+            self.data.append(current_obj)
+        return self
 
-            elif line_re is not None: # and current_obj:
-                # current_obj.append(*line_re.groups())
-                current_obj[line_re.group(1)] = line_re.group(2)
-            elif not line_re:
-                continue
-            else:
-                raise ValueError("Error parsing entity data")
+    @staticmethod
+    def string_table() -> dict:
+        ''' table deduplicating the strings of a decode, seeded with the
+            interned common keys since those show up in every map
+        '''
+        return {key: key for key in map(sys.intern, _COMMON_KEYS)}
 
-        if current_obj:
-            self.append(current_obj)
-        return self
+    @property
+    def state(self):
+        ''' token that changes whenever entities are added, removed, replaced
+            or edited (whether through this list or its .data)
+        '''
+        return (id(self.data),
+                tuple((id(ent), getattr(ent, "version", 0)) for ent in self.data))
 
-    def encode(self):
-        lines = []
+    def iter_encode(self):
+        ''' yields the encoded lump an entity at a time '''
+        if not self.data: yield b"\n"
         for ent in self.data:
-            lines.append("{")
-            for k,v in ent.items():
-                lines.append(f"\"{k}\" \"{v}\"")
-            lines.append("}")
-        return "\n".join(lines).encode(EntityList.CP) + b"\n\x00"
+            lines = ["{", *(f"\"{k}\" \"{v}\"" for k,v in ent.items()), "}", ""]
+            yield "\n".join(lines).encode(EntityList.CP)
+        yield b"\x00"
         # ending above inserts a newline-null termination pair
         # since compiler outputs always adds newline at the end
 
-    def query_select(self, query:str):
-        ''' my take on HTML DOM's querySelectorAll '''
-        qsa_re = re.compile(r"""(?gmix)
-(?:\s|^)                 # new class group start with whitespace or start of line
-(?P<exclude>-)?          # exclude this class group
-(?P<class>\w+\*?|\*)     # classname, can have a wildcard* at the end
-(?:\#(?P<id>\w+))?       # targetname, no spaces
-(?:\|(?P<flags>[\d+]+))? # flags, also flag1+flag2+...
-|(?:(?<=\S)              # selector must not come after whitespace
- \:(?P<selector>\w+)     # name of :selector()
-  \((?P<selector_data>[^)]*)\)) # selector data
-|(?:(?<=\S)              # prop must not come after whitespace
-  \[(?P<prop>[\w#]+)     # name of prop
-    (?:(?P<op>[~^$*]?=|\|) # operator
-    (?:(?P<q>['"])(?P<strval>.*)\9 # "string value"
-      |(?P<val>[\w]*)              # word value
-    ))?\])
-        """)
-        
-        # primary filters
-        f_c = lambda ent,val: ent["classname"].startswith(val.partition("*")[0])
-        f_i = lambda ent,val: ent["targetname"] == val
-        f_f = lambda ent,val: int(ent["spawnflags"]) & sum([int(x) for x in val.split("+")])
-        
-        # property ops
-        f_p_ops = {
-            "=" :  lambda prop,val: prop == val,
-            "^=" : lambda prop,val: prop.startswith(val),
-            "$=" : lambda prop,val: prop.endswith(val),
-            "*=" : lambda prop,val: val in prop,
-            "|" :  lambda prop,val: prop & val,
-        }
-        
-        def _inbounds(ent,mins,maxs):
-            o = [float(a) for a in ent["origin"].split(" ")]
-            i = [float(a) for a in mins.split(" ")]
-            j = [float(a) for a in maxs.split(" ")]
-            return i[0] <= o[0] <= j[0] \
-               and i[1] <= o[1] <= j[1] \
-               and i[2] <= o[2] <= j[2]
-        def _facing(ent,angle,spread):
-            o = [float(a) for a in ent["angles"].split(" ")]
-            i = [float(a) for a in angle.split(" ")]
-            j = [float(a) for a in spread.split(" ")] if spread else [90,0]
-            return i[0]-j[0] <= o[0] <= i[0]+j[0] \
-               and i[1]-j[1] <= o[1] <= i[1]+j[1]
-        f_s = {
-            "point" : lambda ent,_ : "origin" in ent,
-            "solid" : lambda ent,_ : "model" in ent \
-                                     and re.match("\*\d+",ent["model"]),
-            "inbounds": lambda ent, val: _inbounds(ent,val.split(",")),
-            "facing":   lambda ent, val: _facing(ent,val.split(",")),
-        }
-        
-        things = []
-        current = None        
-        for m in qsa_re.finditer(query):
-            if "class" in m.groupdict:
-                if current: things.append(current)
-                current = m.groupdict
-            elif "selector" in m.groupdict:
-                current.setdefault("selectors",[]).append(m.groupdict)
-            elif "prop" in m.groupdict:
-                current.setdefault("props",[]).append(m.groupdict)
-        things.append(current) # get the last item
-        
-        result_set = set()
-        for thing in things:
-            the_list = filter(lambda ent: f_c(ent,thing["class"]), self.data)
-            if "id" in thing:
-                the_list = filter(lambda ent: f_i(ent,thing["id"]), the_list)
-            if "flags" in thing:
-                the_list = filter(lambda ent: f_f(ent,thing["flags"]), the_list)
-            for sel in thing["selectors"]:
-                the_list = filter(lambda ent: \
-                                  f_s[sel["selector"]]\
-                                  (ent, sel["selector_data"]), the_list)
-            for prop in thing["props"]:
-                the_list = filter(lambda ent: prop["prop"] in ent, the_list)
-                if "op" not in prop: continue
-                the_list = filter(lambda ent: \
-                                  f_p_ops[prop["op"]]\
-                                  (ent[prop["prop"]], prop["strval"] or prop["val"]),
-                                  the_list)
-            this_result = set(the_list)
-            
-            if "exclude" in thing:
-                result_set -= this_result
+    def encode(self):
+        return b"".join(self.iter_encode())
+
+    def dump(self, fp):
+        return sum(fp.write(part) for part in self.iter_encode())
+
+    ## indexes for query_select
+
+    def _index_token(self):
+        ''' changes whenever the indexes can't be trusted anymore '''
+        return self.data.stamp
+
+    def _build_indexes(self):
+        self._indexes = {key: {} for key in Entity.INDEXED_KEYS}
+        for ent in self.data: self._index(ent)
+        self._indexed = self._index_token()
+
+    def _index(self, ent):
+        for key, index in self._indexes.items():
+            if key in ent: index.setdefault(ent[key], []).append(ent)
+
+    def _unindex(self, ent):
+        for key, index in self._indexes.items():
+            if key not in ent: continue
+            bucket = index[ent[key]]
+            del bucket[next(i for i, e in enumerate(bucket) if e is ent)]
+
+    def get_index(self, key) -> dict:
+        ''' {value: [entities]} for one of Entity.INDEXED_KEYS '''
+        if getattr(self, "_indexed", None) != self._index_token():
+            self._build_indexes()
+        return self._indexes[key]
+
+    def _indexes_valid(self):
+        return getattr(self, "_indexed", None) == self._index_token()
+
+    def append(self, item):
+        valid = self._indexes_valid()
+        super().append(item)
+        if valid:
+            self._index(item)
+            self._indexed = self._index_token()
+
+    def extend(self, other):
+        for item in other: self.append(item)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def remove(self, item):
+        self.pop(self.index(item))
+
+    def pop(self, i=-1):
+        valid = self._indexes_valid()
+        item = super().pop(i)
+        if valid:
+            self._unindex(item)
+            self._indexed = self._index_token()
+        return item
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            self._indexed = None
+            return super().__delitem__(i)
+        self.pop(i)
+
+    def __setitem__(self, i, item):
+        self._indexed = None # buckets would lose the lump order
+        super().__setitem__(i, item)
+
+    def insert(self, i, item):
+        self._indexed = None
+        super().insert(i, item)
+
+    def sort(self, *args, **kwargs):
+        self._indexed = None
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._indexed = None
+        super().reverse()
+
+    def query_select(self, query:str) -> list:
+        ''' my take on HTML DOM's querySelectorAll
+            groups are separated by whitespace, each one being
+                [-]classname[*][#targetname][|flag+flag...]
+            followed by any number of [prop], [prop<op>value] (ops are =, ^=,
+            $=, *=, ~= and | for flags) and :point, :solid, :inbounds(mins,maxs)
+            or :facing(angles,spread) selectors. a leading - removes the
+            group's matches from the result instead.
+            candidates are looked up from the classname/targetname/model
+            indexes where possible. returns matches in lump order per group
+        '''
+        result = {}
+        for group in _parse_query(query):
+            matches = (ent for ent in self._candidates(group)
+                       if all(test(ent) for test in group.tests))
+            if group.exclude:
+                for ent in matches: result.pop(id(ent), None)
             else:
-                result_set |= this_result
-                
-        return result_set
+                for ent in matches: result.setdefault(id(ent), ent)
+        return list(result.values())
+
+    def _candidates(self, group):
+        if not group.lookups: return self.data
+        buckets = []
+        for key, value, prefix in group.lookups:
+            index = self.get_index(key)
+            if not prefix:
+                buckets.append(index.get(value, ()))
+            else:
+                buckets.append([ent for k, bucket in index.items()
+                                if k.startswith(value) for ent in bucket])
+        return min(buckets, key=len)
+
+
+## query_select parsing
+
+_QUERY_RE = re.compile(r"""
+ (?P<space>\s+)
+|(?P<exclude>-)?(?P<class>\w+\*?|\*)  # classname, can have a wildcard* at the end
+  (?:\#(?P<id>[^\s\[:|]+))?           # targetname, no spaces
+  (?:\|(?P<flags>[\d+]+))?             # flags, also flag1+flag2+...
+|:(?P<selector>\w+)                     # name of :selector()
+  (?:\((?P<selector_data>[^)]*)\))?     # selector data
+|\[(?P<prop>[\w#]+)                     # name of prop
+  (?:(?P<op>[~^$*]?=|\|)                # operator
+    (?:(?P<q>['"])(?P<strval>.*?)(?P=q)  # "string value"
+      |(?P<val>[^\]]*)                   # word value
+  ))?\]
+""", re.X)
+
+def _floats(text):
+    return [float(a) for a in text.split()]
+
+def _inbounds(ent, mins, maxs):
+    if "origin" not in ent: return False
+    o, i, j = _floats(ent["origin"]), _floats(mins), _floats(maxs)
+    return all(a <= b <= c for a, b, c in zip(i, o, j))
+
+def _facing(ent, angle, spread=None):
+    if "angles" not in ent: return False
+    o, i = _floats(ent["angles"]), _floats(angle)
+    j = _floats(spread) if spread else [90, 0]
+    return i[0]-j[0] <= o[0] <= i[0]+j[0] \
+       and i[1]-j[1] <= o[1] <= i[1]+j[1]
+
+_SELECTORS = {
+    "point" : lambda ent, *_ : "origin" in ent,
+    "solid" : lambda ent, *_ : re.fullmatch(r"\*\d+", ent.get("model", "")) is not None,
+    "inbounds": _inbounds,
+    "facing":   _facing,
+}
+
+_PROP_OPS = {
+    "=" :  lambda prop, val: prop == val,
+    "^=" : lambda prop, val: prop.startswith(val),
+    "$=" : lambda prop, val: prop.endswith(val),
+    "*=" : lambda prop, val: val in prop,
+    "~=" : lambda prop, val: val in prop.split(),
+    "|" :  lambda prop, val: int(prop) & int(val),
+}
+
+def _flags_test(ent, mask):
+    try: return int(ent.get("spawnflags", 0)) & mask
+    except ValueError: return False
+
+class _QueryGroup:
+    ''' a compiled class group of a query '''
+    def __init__(self, exclude, classname, targetname=None, flags=None):
+        self.exclude = bool(exclude)
+        self.lookups = [] # (indexed key, value, is prefix)
+        self.tests = []
+        if targetname is not None:
+            self.lookups.append(("targetname", targetname, False))
+            self.tests.append(lambda ent: ent.get("targetname") == targetname)
+        if classname != "*":
+            prefix = classname.endswith("*")
+            value = classname.rstrip("*")
+            self.lookups.append(("classname", value, prefix))
+            self.tests.append((lambda ent: ent.get("classname", "").startswith(value))
+                              if prefix else
+                              (lambda ent: ent.get("classname") == value))
+        if flags:
+            mask = sum(int(x) for x in flags.split("+") if x)
+            self.tests.append(lambda ent: _flags_test(ent, mask))
+
+    def add_selector(self, name, data):
+        if name not in _SELECTORS:
+            raise ValueError(f"Unknown selector :{name}")
+        fn = _SELECTORS[name]
+        args = [a.strip() for a in data.split(",")] if data else []
+        self.tests.append(lambda ent: fn(ent, *args))
+
+    def add_prop(self, prop, op, value):
+        if op is None:
+            self.tests.append(lambda ent: prop in ent)
+            return
+        fn = _PROP_OPS[op]
+        if prop in Entity.INDEXED_KEYS and op in ("=", "^="):
+            self.lookups.append((prop, value, op == "^="))
+        def test(ent):
+            try: return prop in ent and fn(ent[prop], value)
+            except ValueError: return False # non-numeric flags
+        self.tests.append(test)
+
+@lru_cache(maxsize=256)
+def _parse_query(query) -> tuple:
+    ''' parses a query_select query into its compiled class groups '''
+    groups = []
+    pos = 0
+    while pos < len(query):
+        m = _QUERY_RE.match(query, pos)
+        if m is None:
+            raise ValueError(f"Bad query at {pos}: {query[pos:]!r}")
+        pos = m.end()
+        if m["space"]: continue
+        if m["class"]:
+            groups.append(_QueryGroup(m["exclude"], m["class"], m["id"], m["flags"]))
+            continue
+        if not groups: # bare [prop] or :selector applies to everything
+            groups.append(_QueryGroup(None, "*"))
+        if m["selector"]:
+            groups[-1].add_selector(m["selector"], m["selector_data"])
+        else:
+            value = m["strval"] if m["q"] else m["val"]
+            groups[-1].add_prop(m["prop"], m["op"], value)
+    return tuple(groups)
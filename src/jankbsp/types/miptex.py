@@ -3,6 +3,7 @@ from struct import Struct
 from typing import *
 from PIL import Image
 from ..types import ColorArrayView, Color
+from ..enums import MipFilter
 
 class DimensionError(Exception):
     pass
@@ -26,9 +27,26 @@ class MipTex:
     PALETTE_COLORS = 256
     PALETTE_SIZE = 768
     CP = "cp1252"
+    MIP_FILTER = MipFilter.Point # filter used to generate missing mips
+
+    def __setattr__(self, name, value):
+        ''' bumps the version on every assignment to a public field (name,
+            mips, unembed(), etc), so the lump holding it knows it's edited.
+            editing mip/palette buffers in place is not tracked.
+        '''
+        object.__setattr__(self, name, value)
+        if not name.startswith("_"):
+            object.__setattr__(self, "_version", self.version + 1)
+
+    @property
+    def version(self):
+        return self.__dict__.get("_version", 0)
     
     @classmethod
     def decode(cls, rawbytes):
+        ''' mips and palette are slices of rawbytes, so a memoryview input
+            yields miptex data that references it without copying
+        '''
         unpacked = MipTex.STRUCT.unpack_from(rawbytes,0)
         # this _will_ contain junk after the string terminator, 
         # so must be partitioned. after that it must be encoded.
@@ -44,7 +62,7 @@ class MipTex:
         for i in range(4):
             mip_pos = unpacked[3+i]
             mip_len = self.width * self.height // (4**i)
-            setattr(self, f"mip{i}", bytearray(rawbytes[mip_pos:mip_pos+mip_len]))
+            setattr(self, f"mip{i}", rawbytes[mip_pos:mip_pos+mip_len])
             
             if i==3: # load palette at the end of mip3
                 pal_pos = mip_pos + mip_len + 2
@@ -52,34 +70,51 @@ class MipTex:
                         rawbytes[mip_pos+mip_len:pal_pos], 
                         byteorder='little'
                 )
-                self.palette = bytearray(rawbytes[pal_pos:pal_pos+MipTex.PALETTE_SIZE])
+                self.palette = rawbytes[pal_pos:pal_pos+MipTex.PALETTE_SIZE]
 
         return self
 
-    def encode(self, dirty=False):
-        ''' dirty mode stuffs the name back to the raw name struct, hoping it'd
+    def encode_name(self, dirty=False):
+        ''' returns the 16-byte name field of the header.
+            dirty mode stuffs the name back to the raw name struct (if there is
+            one), leaving the garbage after the string terminator as read
+        '''
+        # truncate long names
+        name = self.name.encode(MipTex.CP)[0:15] + b"\x00"
+        if dirty and getattr(self, "_rawname", None):
+            rawname = bytearray(self._rawname)
+            rawname[0:len(name)] = name
+            name = bytes(rawname)
+        return name.ljust(16, b"\x00")
+
+    def iter_encode(self, dirty=False):
+        ''' yields the encoded miptex in parts (header, mips, color count,
+            palette), so that it can be written out without joining them.
+            dirty mode stuffs the name back to the raw name struct, hoping it'd
             recreate the entire lump 1:1 with original if nothing is changed
         '''
-        header_parts = [self.name.encode(MipTex.CP),self.width,self.height]\
+        header_parts = [self.encode_name(dirty),self.width,self.height]\
                 + [0,0,0,0]
-        if dirty:
-            rawname = bytearray(self._rawname)
-            rawname[0:len(header_parts[0])+1] = header_parts[0] + b"\x00"
-            header_parts[0] = rawname
-        # truncate long names
-        if len(header_parts[0]) > 15:
-            header_parts[0] = header_parts[0][0:15] + b"\x00"
-        
-        body = b""
-        if not self.is_external:
-            mip_offs = MipTex.STRUCT.size
-            for i in range(4):
-                header_parts[3+i] = mip_offs + len(body)
-                body += self.get_mip(i) # get_mip generates mips if it doesn't exist
-            # add a short with the color count, then the color palette (fixed size)
-            body += len(self.palette).to_bytes(2,byteorder='little') + self.palette
-            
-        return MipTex.STRUCT.pack(*header_parts) + body
+        if self.is_external:
+            yield MipTex.STRUCT.pack(*header_parts)
+            return
+
+        mips = [self.get_mip(i) for i in range(4)] # generates missing mips
+        mip_offs = MipTex.STRUCT.size
+        for i, mip in enumerate(mips):
+            header_parts[3+i] = mip_offs
+            mip_offs += len(mip)
+        yield MipTex.STRUCT.pack(*header_parts)
+        yield from mips
+        # add a short with the color count, then the color palette (fixed size)
+        yield (len(self.palette) // 3).to_bytes(2,byteorder='little')
+        yield self.palette
+
+    def encode(self, dirty=False):
+        return b"".join(self.iter_encode(dirty))
+
+    def dump(self, fp, dirty=False) -> int:
+        return sum(fp.write(part) for part in self.iter_encode(dirty))
 
     @property
     def size(self):
@@ -87,8 +122,8 @@ class MipTex:
             the total mip size is 1 + 1/4 + 1/16 + 1/64 times the size of the first
         '''
         return MipTex.STRUCT.size if self.is_external \
-        else MipTex.STRUCT.size + MipTex.PALETTE_PAD + MipTex.PALETTE_SIZE \
-                + int(len(self.mip0) * 1.328125)
+        else MipTex.STRUCT.size + MipTex.PALETTE_PAD + len(self.palette) \
+                + sum(self.width * self.height // 4**i for i in range(4))
                 
     @property
     def lname(self):
@@ -114,21 +149,41 @@ class MipTex:
         """
         if self.mip0 is None:
             return None
-        elif getattr(self,f"mip{level}") is not None:
-            return getattr(self,f"mip{level}")
-        # implicit else
-        
-        # prepare the byte array of the target mip level
-        values = bytearray(self.width*self.height/4**level)
-        pos = 0
-        # sample the about center pixel of each 2^levelx2^level square
-        for row in range(2*(level-1), self.height, 2**level):
-            for col in range(2*(level-1), self.width, 2**level):
-                values[pos] = self.mip0[row*self.width+col]
-                pos += 1
-
-        setattr(self, f"mip{level}", values)
-        return values
+        elif getattr(self,f"mip{level}") is None:
+            self.generate_mips()
+        return getattr(self,f"mip{level}")
+
+    def generate_mips(self, filter:MipFilter=None, overwrite=False):
+        ''' generates the missing mips 1-3 off mip0 in one go
+            (all of them if overwrite), with the given filter or MIP_FILTER:
+            - Point samples the about center pixel of each 2^level square
+            - Box averages the colors of each square, matched back to the
+              nearest palette entry (smoother, but may bleed transparent
+              or fog colors into the edges)
+        '''
+        if self.mip0 is None: return self
+        filter = filter or self.MIP_FILTER
+        if filter == MipFilter.Box:
+            src = self.to_image().convert("RGB")
+            palette_img = Image.new("P", (1,1))
+            palette_img.putpalette(self.palette)
+        else: # work on the indices as is
+            src = Image.frombuffer("L", (self.width,self.height), self.mip0,
+                                   "raw", "L", 0, 1)
+
+        for level in range(1,4):
+            if getattr(self,f"mip{level}") is not None and not overwrite:
+                continue
+            factor = 2**level
+            if filter == MipFilter.Box:
+                img = src.reduce(factor).quantize(palette=palette_img,
+                                                  dither=Image.NONE)
+            else:
+                # nearest resampling picks the pixel at the center of each box
+                img = src.resize((self.width//factor, self.height//factor),
+                                 Image.NEAREST)
+            setattr(self, f"mip{level}", img.tobytes())
+        return self
 
     @classmethod
     def from_image(cls, img:Image, name):
@@ -140,17 +195,29 @@ class MipTex:
         this = cls(name[0:15], img.width, img.height)
 
         # save only the full size mip
-        this.mip0 = b"".join(img.getdata())
-        this.palette = b"".join(img.getpalette())
+        this.mip0 = img.tobytes()
+        palette = img.getpalette("RGB") if img.mode == "P" \
+                  else [c for c in range(256) for _ in range(3)] # grayscale
+        this.palette = bytes(palette).ljust(MipTex.PALETTE_SIZE, b"\x00")
         return this
     
-    def to_image(self):
-        if self.mip0 is None: return None
-        img = Image.new("P", (self.width,self.height))
+    def to_image(self, level=0):
+        ''' returns the given mip level as an indexed image.
+            the image shares memory with the mip instead of copying it, so it
+            is read-only (PIL copies it if it's ever edited)
+        '''
+        mip = self.get_mip(level)
+        if mip is None: return None
+        size = (self.width // 2**level, self.height // 2**level)
+        img = Image.frombuffer("P", size, mip, "raw", "P", 0, 1)
         img.putpalette(self.palette)
-        img.putdata(self.mip0)
         return img
 
+    def palette_image(self):
+        ''' returns the palette as a 16x16 RGB image, a pixel per entry '''
+        if self.palette is None: return None
+        return Image.frombuffer("RGB", (16,16), self.palette, "raw", "RGB", 0, 1)
+
     def fix_water(self, fog_color:Color|bytes|str=None,fog_intensity:int=None):
         ''' if water texture bitmap data points to index #3 or #4,
             re-quantize the image to vacate the bitmap from those indices
@@ -163,7 +230,7 @@ class MipTex:
         # mip0 doesn't point to palette #3/4 (no problem)
         if self.name[0] != "!" \
         or not self.mip0 \
-        or not b"\x03" in self.mip0 or not b"\x04" in self.mip0:
+        or not b"\x03" in bytes(self.mip0) or not b"\x04" in bytes(self.mip0):
             return self
         
         # quantize and get new mip and palette
@@ -171,7 +238,7 @@ class MipTex:
                 colors=254, # 256 minus 2 fog indices
                 method=Image.MAXCOVERAGE
         )
-        mip = bytearray(new_img.getdata())
+        mip = bytearray(new_img.tobytes())
         pal = bytearray(new_img.getpalette())
         
         # prepare values for palette #3 and #4
@@ -179,7 +246,7 @@ class MipTex:
             pal3 = bytes.fromhex(str)[0:3]
         elif isinstance(fog_color,bytes):
             pal3 = fog_color[0:3]
-        elif isinsntace(fog_color,Color):
+        elif isinstance(fog_color,Color):
             pal3 = fog_color.encode()
         else:
             pal3 = self.palette[9:12] # copy existing value
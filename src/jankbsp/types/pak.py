@@ -11,25 +11,28 @@ class BadPakFile(Exception):
 @dataclass
 class PakHeader:
     magic: bytes = b"PACK"
-    entries: int = 0
     dir_offset: int = 0
-    
+    dir_size: int = 0 # in bytes, not entries
+
     STRUCT = Struct("<4sii")
     MAGICVAL = b"PACK"
     HEADER_OFFSET = 0
-    
+
+    @property
+    def entries(self): return self.dir_size // PakDirEntry.STRUCT.size
+
     @classmethod
     def decode(cls, rawbytes):
         unpacked = cls.STRUCT.unpack(rawbytes)
         if unpacked[0] != cls.MAGICVAL:
-            raise BadPakFile(" ".join(
+            raise BadPakFile(" ".join((
                 "Unrecognized file type",
                 f"(signature '{str(unpacked[0])}' instead of '{str(cls.MAGICVAL)}')"
-            ))
+            )))
         return cls(*unpacked)
         
     def encode(self):
-        return this.STRUCT.pack(*astuple(self))
+        return self.STRUCT.pack(*astuple(self))
         
     def astuple(self):
         return astuple(self)        
@@ -1,20 +1,79 @@
 from dataclasses import dataclass, field, astuple, asdict
 from collections import UserList # palette
 from collections.abc import MutableSequence # palette
-from struct import Struct
+from struct import Struct, calcsize
 from typing import *
 from ..enums import PlaneTypes
+import re
+try:
+    import numpy as np # optional, for the array backend of data lumps
+except ImportError:
+    np = None
+
+# struct format char -> numpy type char (sizes as in standard "<" mode)
+_DTYPE_CHARS = {
+    "c":"u1", "b":"i1", "B":"u1", "?":"?", "h":"i2", "H":"u2", "i":"i4",
+    "I":"u4", "l":"i4", "L":"u4", "q":"i8", "Q":"u8", "e":"f2", "f":"f4",
+    "d":"f8"
+}
+
+def struct_dtype(struct:Struct, fields=None):
+    ''' returns the numpy dtype with the same layout as the little-endian
+        struct, or None if numpy isn't available.
+        fields is a sequence of (name, count) pairs consuming the struct's
+        values in order, count > 1 making it a subarray. without fields, a
+        single-value struct gives a plain dtype, else fields are named f0, f1...
+    '''
+    if np is None: return None
+
+    scalars = [] # (format, offset) of every value in the struct
+    offset = 0
+    for count, char in re.findall(r"(\d*)([a-zA-Z?])", struct.format):
+        count = int(count) if count else 1
+        if char == "x":
+            offset += count
+        elif char == "s":
+            scalars.append((f"S{count}", offset))
+            offset += count
+        else:
+            for _ in range(count):
+                scalars.append(("<" + _DTYPE_CHARS[char], offset))
+                offset += calcsize("<" + char)
+
+    if fields is None and len(scalars) == 1:
+        return np.dtype(scalars[0][0])
+    fields = fields or [(f"f{i}", 1) for i in range(len(scalars))]
+
+    names, formats, offsets = [], [], []
+    pos = 0
+    for name, count in fields:
+        fmt, offset = scalars[pos]
+        names.append(name)
+        formats.append(fmt if count == 1 else (fmt, (count,)))
+        offsets.append(offset)
+        pos += count
+    return np.dtype({"names":names, "formats":formats,
+                     "offsets":offsets, "itemsize":struct.size})
+
 
 class StructData:
     ''' template data class that can be decoded/encoded from/to bytes
         use derived classes with @dataclasses only!
+        DTYPE_FIELDS names the struct values for struct_dtype()
     '''
     STRUCT = Struct("<i") # sample
+    DTYPE_FIELDS = None
     @classmethod
     def decode(cls, rawbytes):
         return cls(*cls.STRUCT.unpack(rawbytes))
+    def values(self) -> tuple:
+        ''' flat tuple of the values in STRUCT order. override for nested data '''
+        return astuple(self)
     def encode(self) -> bytearray:
-        return self.__class__.STRUCT.pack(*astuple(self))
+        return self.__class__.STRUCT.pack(*self.values())
+    def encode_into(self, buffer, offset=0):
+        ''' packs straight into a writable buffer, e.g. to reuse it '''
+        self.__class__.STRUCT.pack_into(buffer, offset, *self.values())
     def astuple(self):
         return astuple(self)
 
@@ -29,6 +88,7 @@ class Vector(StructData):
     y: float
     z: float
     STRUCT = Struct("<3f")
+    DTYPE_FIELDS = (("x",1), ("y",1), ("z",1))
 
 @dataclass
 class Point(StructData):
@@ -97,6 +157,8 @@ class BspModel(StructData):
     face_index: int
     face_count: int
     STRUCT = Struct("<9f7i")
+    DTYPE_FIELDS = (("mins",3), ("maxs",3), ("origin",3), ("headnode",4),
+                    ("visleafs",1), ("face_index",1), ("face_count",1))
     @classmethod
     def decode(cls, rawbytes):
         unpacked = BspModel.STRUCT.unpack(rawbytes)
@@ -106,9 +168,9 @@ class BspModel(StructData):
             tuple(unpacked[9:13]), # headnode
             *unpacked[13:] # visleafs, face_index, face_count
         )
-    def encode(self):
+    def values(self):
         parts = astuple(self)
-        return BspModel.STRUCT.pack(
+        return (
             *parts[0][0], *parts[0][1],
             *parts[1],
             *parts[2],
@@ -121,12 +183,13 @@ class BspPlane(StructData):
     distance: float
     type: PlaneTypes
     STRUCT = Struct("<4fi")
+    DTYPE_FIELDS = (("normal",3), ("distance",1), ("type",1))
     @classmethod
     def decode(cls, rawbytes):
         unpacked = BspPlane.STRUCT.unpack(rawbytes)
         return cls(Vector(*unpacked[0:3]), *unpacked[3:])
-    def encode(self):
-        return BspPlane.STRUCT.pack(*self.normal.astuple(), self.distance, self.type)
+    def values(self):
+        return (*self.normal.astuple(), self.distance, self.type)
 
 @dataclass
 class BspNode(StructData):
@@ -136,6 +199,8 @@ class BspNode(StructData):
     face_index: int
     face_count: int
     STRUCT = Struct("<ihh6hHH")
+    DTYPE_FIELDS = (("plane_id",1), ("children",2), ("mins",3), ("maxs",3),
+                    ("face_index",1), ("face_count",1))
     @classmethod
     def decode(cls, rawbytes):
         unpacked = BspNode.STRUCT.unpack(rawbytes)
@@ -145,9 +210,9 @@ class BspNode(StructData):
             ShortBoundingBox(Point(*unpacked[3:6]),Point(*unpacked[6:9])),
             *unpacked[9:]
         )
-    def encode(self):
+    def values(self):
         parts = astuple(self)
-        return BspNode.STRUCT.pack(
+        return (
             parts[0],
             *parts[1],
             *parts[2][0], *parts[2][1],
@@ -158,12 +223,13 @@ class BspClipNode(StructData):
     plane_id: int
     children: Tuple[int,int] # front,back; negative is contents
     STRUCT = Struct("<Ihh")
+    DTYPE_FIELDS = (("plane_id",1), ("children",2))
     @classmethod
     def decode(cls, rawbytes):
         unpacked = BspClipNode.STRUCT.unpack(rawbytes)
         return cls( unpacked[0], tuple(unpacked[1:3]) )
-    def encode(self):
-        return BspClipNode.STRUCT.pack( self.plane_id, *self.children )
+    def values(self):
+        return ( self.plane_id, *self.children )
 
 @dataclass
 class BspTexInfo(StructData):
@@ -174,6 +240,8 @@ class BspTexInfo(StructData):
     miptex_id: int
     flags: int
     STRUCT = Struct("<8fII")
+    DTYPE_FIELDS = (("s_vector",3), ("s_shift",1), ("t_vector",3),
+                    ("t_shift",1), ("miptex_id",1), ("flags",1))
     @classmethod
     def decode(cls, rawbytes):
         unpacked = BspTexInfo.STRUCT.unpack(rawbytes)
@@ -182,9 +250,9 @@ class BspTexInfo(StructData):
             Vector(*unpacked[4:7]), unpacked[7],
             *unpacked[8:]
         )
-    def encode(self):
+    def values(self):
         parts = astuple(self)
-        return BspTexInfo.STRUCT.pack(
+        return (
             *parts[0], parts[1],
             *parts[2], parts[3],
             *parts[4:]
@@ -200,19 +268,23 @@ class BspFace(StructData):
     styles: Tuple[int,int,int,int]
     lightmap_offset: int
     STRUCT = Struct("<2HI2H4cI")
+    DTYPE_FIELDS = (("plane_id",1), ("plane_side",1), ("edge_index",1),
+                    ("edge_count",1), ("texinfo_id",1), ("styles",4),
+                    ("lightmap_offset",1))
     @classmethod
     def decode(cls, rawbytes):
         unpacked = BspFace.STRUCT.unpack(rawbytes)
         return cls( *unpacked[0:5], tuple(unpacked[5:9]), unpacked[9] )
-    def encode(self):
+    def values(self):
         parts = astuple(self)
-        return BspFace.STRUCT.pack( *parts[0:5], *parts[5], parts[6] )
+        return ( *parts[0:5], *parts[5], parts[6] )
 
 @dataclass
 class BspEdge(StructData):
     index1: int
     index2: int
     STRUCT = Struct("<2H")
+    DTYPE_FIELDS = (("index1",1), ("index2",1))
     def reversed(self):
         ''' surfedges pointing to a negative index is asking for edge where the 
             two indices were flipped
@@ -228,6 +300,9 @@ class BspLeaf(StructData):
     marksurface_count: int # length of marksurfaces
     ambient_levels: Tuple[int,int,int,int] # UNUSED
     STRUCT = Struct("<ii6h2H4c")
+    DTYPE_FIELDS = (("contents",1), ("visleaf",1), ("mins",3), ("maxs",3),
+                    ("marksurface_index",1), ("marksurface_count",1),
+                    ("ambient_levels",4))
     @classmethod
     def decode(cls, rawbytes):
         unpacked = BspLeaf.STRUCT.unpack(rawbytes)
@@ -236,9 +311,9 @@ class BspLeaf(StructData):
             ShortBoundingBox( Point(*unpacked[2:5]), Point(*unpacked[5:8]) ),
             *unpacked[8:10], tuple(unpacked[10:])
         )
-    def encode(self):
+    def values(self):
         parts = astuple(self)
-        return BspLeaf.STRUCT.pack( 
+        return ( 
             *parts[0:2], 
             *parts[2][0], *parts[2][1], 
             *parts[3:5], *parts[5]
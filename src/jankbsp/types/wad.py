@@ -22,14 +22,14 @@ class WadHeader:
     def decode(cls, rawbytes):
         unpacked = cls.STRUCT.unpack(rawbytes)
         if unpacked[0] != cls.MAGICVAL:
-            raise BadWadFile(" ".join(
+            raise BadWadFile(" ".join((
                 "Unrecognized file type",
                 f"(signature '{str(unpacked[0])}' instead of '{str(cls.MAGICVAL)}')"
-            ))
+            )))
         return cls(*unpacked)
         
     def encode(self):
-        return this.STRUCT.pack(*astuple(self))
+        return self.STRUCT.pack(*astuple(self))
         
     def astuple(self):
         return astuple(self)        
@@ -81,9 +81,7 @@ class WadMipTex(MipTex):
     def unembed(self):
         raise NotImplementedError("Cannot unembed WAD textures")
     
-    # load and dump methods provided for easier io
+    # load method provided for easier io (dump is inherited)
     @classmethod
     def load(cls, fp, length):
         return cls.decode(fp.read(length))
-    def dump(self, fp) -> int:
-        return fp.write(self.encode()) # returns number of bytes written
@@ -1,5 +1,8 @@
 from .types.wad import WadHeader, WadDirEntry, WadMipTex, BadWadFile
 from dataclasses import dataclass, field, astuple
+from mmap import mmap, ACCESS_READ # open_mmap
+from operator import attrgetter # read_miptexes
+from zlib import crc32 # checksums
 from PIL import Image
 
 @dataclass
@@ -14,11 +17,135 @@ class WadFile:
 
         miptexes list is ABSENT in this implementation. Please use
         self.entries[n]._miptex to get the miptex data associated with the entry.
+
+        With open_mmap, only the directory is read, and miptexes are decoded
+        off the memory map when looked up by name: wad["name"] for one, or
+        read_miptexes() for many at once.
     '''
     header: WadHeader = field(default_factory=WadHeader)
     entries: list[WadDirEntry] = field(default_factory=list)
     _only_entries: bool        = False
     # miptexes: list[WadMipTex] = field(default_factory=list)
+    _mmap: mmap = field(default=None, repr=False, compare=False)
+    _index: dict = field(default=None, repr=False, compare=False)
+
+    # gap under which reads of neighbouring miptexes are merged into one
+    COALESCE_GAP = 65536
+
+    @classmethod
+    def open_mmap(cls, path, entries=None):
+        ''' maps the wad read-only and reads its directory only.
+            entries can be given to skip reading the directory, if known
+        '''
+        with open(path, "rb") as fp:
+            map_ = mmap(fp.fileno(), 0, access=ACCESS_READ)
+        try:
+            return cls.from_buffer(map_, entries)
+        except Exception:
+            map_.close()
+            raise
+
+    @classmethod
+    def from_buffer(cls, buffer, entries=None):
+        ''' same as open_mmap, over a wad already in memory (e.g. read off a
+            pak). the buffer takes the place of the memory map
+        '''
+        header = WadHeader.decode(buffer[0:WadHeader.STRUCT.size])
+        if entries is None:
+            size = WadDirEntry.STRUCT.size
+            dir_raw = buffer[header.dir_offset:header.dir_offset+size*header.entries]
+            entries = [WadDirEntry.decode(dir_raw[n*size:n*size+size]) \
+                       for n in range(header.entries)]
+        return cls(header, list(entries), True, buffer)
+
+    def close(self):
+        ''' releases the memory map, if opened with open_mmap '''
+        if self._mmap is None: return
+        if hasattr(self._mmap, "close"): self._mmap.close()
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def name_index(self) -> dict:
+        ''' {lowercase name: entry}, the first entry winning on duplicates '''
+        if self._index is None:
+            self._index = {}
+            for entry in self.entries:
+                self._index.setdefault(entry.name.lower(), entry)
+        return self._index
+
+    def find(self, name) -> WadDirEntry|None:
+        ''' case-insensitive lookup of an entry by name '''
+        return self.name_index.get(name.lower())
+
+    def __contains__(self, name):
+        return name.lower() in self.name_index
+
+    def __getitem__(self, name) -> WadMipTex:
+        ''' the miptex of the named entry, decoded on first access '''
+        entry = self.find(name)
+        if entry is None: raise KeyError(name)
+        return self.read_miptexes([entry.name])[entry.name]
+
+    def read_miptexes(self, names, fp=None) -> dict:
+        ''' returns {entry name: miptex} for the entries found of names.
+            the wanted entries are read in order of offset, neighbouring ones
+            in a single read. reads off the memory map, or fp if given.
+        '''
+        wanted = {}
+        for name in names:
+            entry = self.find(name)
+            if entry is not None: wanted[id(entry)] = entry
+
+        result = {}
+        pending = []
+        for entry in sorted(wanted.values(), key=attrgetter("offset")):
+            if hasattr(entry, "_miptex"): # decoded already
+                result[entry.name] = entry._miptex
+            elif pending and entry.offset - self._run_end(pending) > self.COALESCE_GAP:
+                self._read_run(pending, fp, result)
+                pending = [entry]
+            else:
+                pending.append(entry)
+        if pending: self._read_run(pending, fp, result)
+        return result
+
+    def checksums(self, fp=None) -> dict:
+        ''' {entry name: crc32 of its data on disk}, off the map or fp '''
+        result = {}
+        for entry in self.entries:
+            if fp is not None:
+                fp.seek(entry.offset)
+                result[entry.name] = crc32(fp.read(entry.sizeondisk))
+            elif self._mmap is not None:
+                with memoryview(self._mmap) as view:
+                    result[entry.name] = crc32(
+                            view[entry.offset:entry.offset+entry.sizeondisk])
+            else:
+                raise ValueError("No memory map or file to read entries from")
+        return result
+
+    @staticmethod
+    def _run_end(run):
+        return max(entry.offset + entry.sizeondisk for entry in run)
+
+    def _read_run(self, run, fp, result):
+        start, end = run[0].offset, self._run_end(run)
+        if fp is not None:
+            fp.seek(start)
+            chunk = memoryview(fp.read(end - start))
+        elif self._mmap is not None:
+            chunk = memoryview(self._mmap[start:end]) # copied off the map
+        else:
+            raise ValueError("No memory map or file to read miptexes from")
+        for entry in run:
+            offset = entry.offset - start
+            entry._miptex = WadMipTex.decode(bytes(chunk[offset:offset+entry.sizeondisk]))
+            result[entry.name] = entry._miptex
 
     @classmethod
     def load(cls, fp, only_entries=False):
@@ -51,7 +178,7 @@ class WadFile:
             if only_entries was True during load, only dump miptexes at the end
             of the existing wad of data, whose entries were added later
         """
-        entries_to_dump = filter(lambda x: not x._no_data, self.entries)
+        entries_to_dump = filter(lambda x: not getattr(x, "_no_data", False), self.entries)
         if self._only_entries and header.dir_offset == header.STRUCT.size:
             ''' if direntry happen to come after the header in this mode,
                 skip to the very end (this will leave dead data at the start)
@@ -83,8 +210,9 @@ class WadFile:
 
     def add_image(self, img:Image, name:str):
         new_entry = WadDirEntry(name=name)
-        new_entry._miptex = MipTex.from_image(img, name)
+        new_entry._miptex = WadMipTex.from_image(img, name)
         self.entries.append(new_entry)
+        self._index = None
 
     def remove(self, entry:WadDirEntry|int|str):
         ''' remove items by index, name, or entry
@@ -96,6 +224,7 @@ class WadFile:
             self.entries.remove(entry)
         else: # integer, use pop()
             self.entries.pop(entry)
+        self._index = None
 
     @property
     def entrynames(self):
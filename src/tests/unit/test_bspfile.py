@@ -0,0 +1,101 @@
+''' unit tests for jankbsp.BspFile
+'''
+import unittest, sys, io
+from pathlib import Path
+from struct import Struct
+# inject sys.path to be able to load jankbsp
+sys.path.append(str(Path(__file__).parents[2]))
+from jankbsp import BspFile
+from jankbsp.enums import Lumps
+from jankbsp.types import MipTex, BspLeaf, BspModel
+
+
+def make_bsp(texnames=("wall1", "floor2"), **extra) -> bytes:
+    ''' a small but valid bsp: worldspawn, external textures, one edge.
+        extra overrides lumps by name, e.g. Visibility=b"..."
+    '''
+    lumps = {lump: b"" for lump in Lumps}
+    lumps[Lumps.Entities] = b'{\n"classname" "worldspawn"\n}\n\x00'
+    miptexes = [MipTex.STRUCT.pack(name.encode(), 16, 16, 0, 0, 0, 0)
+                for name in texnames]
+    front_size = 4 + 4 * len(miptexes)
+    lumps[Lumps.Textures] = b"".join(
+            [len(miptexes).to_bytes(4, "little")]
+            + [(front_size + i * MipTex.STRUCT.size).to_bytes(4, "little")
+               for i in range(len(miptexes))]
+            + miptexes)
+    lumps[Lumps.Vertices] = Struct("<6f").pack(0, 0, 0, 64, 0, 0)
+    lumps[Lumps.Edges] = Struct("<2H").pack(0, 1)
+    lumps.update((Lumps[name], data) for name, data in extra.items())
+
+    data = bytearray(BspFile.HEADER_STRUCT.size)
+    lump_dir = []
+    for lump in Lumps:
+        data += bytes(-len(data) % 4) # lumps are 4-byte aligned
+        lump_dir += [len(data), len(lumps[lump])]
+        data += lumps[lump]
+    data[0:BspFile.HEADER_STRUCT.size] = BspFile.HEADER_STRUCT.pack(
+            BspFile.MAGIC, *lump_dir)
+    return bytes(data)
+
+
+class TestBspPatch(unittest.TestCase):
+    def setUp(self):
+        self.raw = make_bsp()
+
+    def load(self, arrays):
+        return BspFile(io.BytesIO(self.raw), lazy=False, arrays=arrays)
+
+    def testUneditedPatchesNothing(self):
+        for arrays in (False, True):
+            with self.subTest(arrays=arrays):
+                bsp = self.load(arrays)
+                self.assertFalse(any(lump.dirty for lump in bsp.lumps.values()))
+                fp = io.BytesIO(self.raw)
+                self.assertEqual(bsp.patch(fp), 0)
+                self.assertEqual(fp.getvalue(), self.raw)
+
+    def testRenamePatchesInPlace(self):
+        for arrays in (False, True):
+            with self.subTest(arrays=arrays):
+                bsp = self.load(arrays)
+                bsp.textures[0].name = "renamed"
+                fp = io.BytesIO(self.raw)
+                self.assertEqual(bsp.patch(fp), 16)
+                self.assertEqual(len(fp.getvalue()), len(self.raw))
+                reloaded = BspFile(io.BytesIO(fp.getvalue()))
+                self.assertEqual([x.name for x in reloaded.textures],
+                                 ["renamed", "floor2"])
+
+    def testDataEditNeedsDump(self):
+        for arrays in (False, True):
+            with self.subTest(arrays=arrays):
+                bsp = self.load(arrays)
+                if arrays: bsp.vertices[1]["x"] = 128
+                else: bsp.vertices[1].x = 128
+                self.assertTrue(bsp.lumps[Lumps.Vertices].dirty)
+                self.assertIsNone(bsp.patch(io.BytesIO(self.raw)))
+
+
+class TestBspVis(unittest.TestCase):
+    def setUp(self):
+        # 10 leaves (plus leaf 0) all sharing one row: leaves 1 and 10 visible,
+        # and the 6 padding bits of the last byte set
+        leaf0 = BspLeaf.STRUCT.pack(0, -1, *[0]*6, 0, 0, *[b"\x00"]*4)
+        leaf = BspLeaf.STRUCT.pack(0, 0, *[0]*6, 0, 0, *[b"\x00"]*4)
+        model = BspModel.STRUCT.pack(*[0.0]*9, 0, 0, 0, 0, 10, 0, 0)
+        raw = make_bsp(Visibility=b"\x01\xfe", Leafs=leaf0 + leaf*10,
+                       Models=model)
+        self.vis = BspFile(io.BytesIO(raw)).lumps[Lumps.Visibility]
+
+    def testVisibleLeafIndices(self):
+        self.assertEqual(self.vis.visleaf_count, 10)
+        self.assertEqual(self.vis.visible_leaf_indices(0), [1, 10])
+
+    def testIsVisible(self):
+        visible = [i for i in range(-1, 20) if self.vis.is_visible(0, i)]
+        self.assertEqual(visible, [1, 10])
+
+
+if __name__ == "__main__":
+    unittest.main()
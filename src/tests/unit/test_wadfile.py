@@ -0,0 +1,41 @@
+''' unit tests for jankbsp.WadFile
+'''
+import unittest, sys, io
+from pathlib import Path
+# inject sys.path to be able to load jankbsp
+sys.path.append(str(Path(__file__).parents[2]))
+from jankbsp import WadFile
+from jankbsp.types.wad import WadMipTex
+from PIL import Image
+
+
+def make_image(width=16, height=32):
+    img = Image.new("P", (width, height))
+    img.putpalette([i % 256 for i in range(768)])
+    img.putdata([i % 256 for i in range(width * height)])
+    return img
+
+
+class TestWadFile(unittest.TestCase):
+    def testAddImageRoundTrip(self):
+        img = make_image()
+        wad = WadFile()
+        wad.add_image(img, "newtex")
+        self.assertIsInstance(wad.entries[0]._miptex, WadMipTex)
+
+        fp = io.BytesIO()
+        wad.dump(fp)
+
+        loaded = WadFile.load(io.BytesIO(fp.getvalue()))
+        self.assertEqual([x.name for x in loaded.entries], ["newtex"])
+        miptex = loaded.entries[0]._miptex
+        self.assertEqual((miptex.width, miptex.height), img.size)
+        self.assertEqual(miptex.mip0, img.tobytes())
+
+        # and the same read off a buffer, by name
+        mapped = WadFile.from_buffer(fp.getvalue())
+        self.assertEqual(mapped["NEWTEX"].to_image().tobytes(), img.tobytes())
+
+
+if __name__ == "__main__":
+    unittest.main()